@@ -0,0 +1,43 @@
+"""Compare JSON and binary server call encoding, run with `python -m benchmarks.bench_wire`"""
+import json
+import random
+import timeit
+
+from brickie import wire
+
+random.seed(0)
+
+SHAPES = {
+    'small_dict': {'a': [1, 'user', True], 'k': {'limit': 20, 'offset': 0}},
+    'records': [
+        {'id': i, 'name': f'item {i}', 'price': random.random() * 100, 'tags': ['a', 'b']}
+        for i in range(1000)
+    ],
+    'nested': {'l0': {'l1': {'l2': {'l3': {'values': list(range(10)), 'name': 'deep'}}}}},
+    'floats_10k': [random.random() for _ in range(10_000)],
+    'ints_10k': [random.randint(-2 ** 40, 2 ** 40) for _ in range(10_000)],
+    'bytes_100k': random.randbytes(100_000),
+}
+
+
+def bench(f, number):
+    return min(timeit.repeat(f, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    print(f'{"shape":<12} {"format":<7} {"size (B)":>10} {"encode (us)":>12} {"decode (us)":>12}')
+    for name, value in SHAPES.items():
+        formats = {'binary': (wire.dumps, wire.loads)}
+        if not isinstance(value, bytes):
+            formats['json'] = (lambda v: json.dumps(v).encode('utf-8'), json.loads)
+
+        for fmt, (dumps, loads) in formats.items():
+            encoded = dumps(value)
+            number = max(1, 20_000 // max(1, len(encoded) // 100))
+            encode_us = bench(lambda: dumps(value), number)
+            decode_us = bench(lambda: loads(encoded), number)
+            print(f'{name:<12} {fmt:<7} {len(encoded):>10} {encode_us:>12.1f} {decode_us:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
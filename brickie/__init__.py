@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import threading
+
 from collections import defaultdict
 from pathlib import Path
 from typing import Callable
@@ -11,43 +13,99 @@ from .client.style import Style
 
 _endpoint_registry: dict[str, Callable] = WeakValueDictionary()
 _endpoint_keys: dict[Path, set] = defaultdict(set)
+_endpoint_options: dict[str, dict] = {}
+
+# Registrations made by dev reloads on the reload thread, staged to be installed together on the event loop
+_endpoint_staging = threading.local()
+
+
+def _get_server_key(f, module_name: str) -> str:
+    import hashlib
+    import inspect
+    import re
+    import tokenize
+
+    # Ignore trailing comments as AST does not retain them
+    lines, lnum = inspect.findsource(f)
+    lines = inspect.getblock(lines[lnum:])
+    tokens = tokenize.generate_tokens(iter(lines).__next__)
+    block_finder = inspect.BlockFinder()
+    try:
+        for t in tokens:
+            if t.type is tokenize.COMMENT:
+                continue
+            block_finder.tokeneater(*t)
+    except (inspect.EndOfBlock, IndentationError):
+        pass
+
+    # Strip decorators, keys are computed from the function definition onwards
+    src = ''.join(lines[:block_finder.last])
+    src = src[re.search(r'^[ \t]*((async[ \t]+)?def[ \t])', src, re.M).start(1):].strip()
+
+    unique_id = f'{module_name}|{f.__qualname__}|{src}'
+    return hashlib.sha256(unique_id.encode('utf-8')).hexdigest()
 
 
-def server(f, is_method=False):
+def server(f=None, is_method=False, stream=False, cache=None, single_flight=False, executor=None):
     from . import env
 
+    if f is None:
+        return lambda f: server(
+            f,
+            is_method=is_method,
+            stream=stream,
+            cache=cache,
+            single_flight=single_flight,
+            executor=executor)
+
     if not env.IS_CLIENT:
         if isinstance(f, type):
             return f
 
-        import hashlib
         import inspect
-        import tokenize
+
+        from . import manifest
         module = inspect.getmodule(f)
         module_name = module.__name__
-
-        # Ignore trailing comments as AST does not retain them
-        lines, lnum = inspect.findsource(f)
-        lines = inspect.getblock(lines[lnum:])
-        tokens = tokenize.generate_tokens(iter(lines).__next__)
-        block_finder = inspect.BlockFinder()
-        try:
-            for t in tokens:
-                if t.type is tokenize.COMMENT:
-                    continue
-                block_finder.tokeneater(*t)
-        except (inspect.EndOfBlock, IndentationError):
-            pass
-
-        src = ''.join(lines[:block_finder.last])
-        src = 'async def ' + src.split('async def ', 1)[-1].strip()
-
-        unique_id = f'{module_name}|{f.__qualname__}|{src}'
-        key = hashlib.sha256(unique_id.encode('utf-8')).hexdigest()
-        if key in _endpoint_registry and not env._is_reload_context:
+        module_path = Path(module.__file__).absolute()
+
+        # Use key from last build if module is unchanged, skipping source hashing
+        key = None
+        if not env._is_reload_context:
+            key = manifest.get_key(module_path, module_name, f.__qualname__)
+        if key is None:
+            key = _get_server_key(f, module_name)
+        manifest.record(module_path, module_name, f.__qualname__, key)
+
+        from .cache import ResultCache, _endpoint_caches
+        registry = getattr(_endpoint_staging, 'registry', None) or (
+            _endpoint_registry, _endpoint_keys, _endpoint_options, _endpoint_caches
+        )
+        endpoint_registry, endpoint_keys, endpoint_options, endpoint_caches = registry
+
+        if key in endpoint_registry and not env._is_reload_context:
             raise RuntimeError('Server key collision')
-        _endpoint_registry[key] = f
-        _endpoint_keys[Path(module.__file__).absolute()].add(key)
+        if inspect.isgeneratorfunction(f):
+            raise RuntimeError('Only async generator server functions supported for streaming')
+        endpoint_registry[key] = f
+        endpoint_keys[module_path].add(key)
+
+        if cache:
+            if inspect.isasyncgenfunction(f):
+                raise ValueError('Cache not supported for streaming server functions')
+            endpoint_caches[key] = ResultCache(**({} if cache is True else cache))
+
+        if executor not in (None, 'thread', 'process'):
+            raise ValueError(f'Unknown server function executor "{executor}"')
+        if executor and inspect.isasyncgenfunction(f):
+            raise ValueError('Executor not supported for streaming server functions')
+        if executor == 'process' and '<locals>' in f.__qualname__:
+            raise ValueError('Process executor requires server function importable by qualname')
+
+        endpoint_options[key] = {
+            'single_flight': single_flight,
+            'executor': executor,
+        }
         return f
 
     # Check server decorator transformed by ast transformer
@@ -55,15 +113,24 @@ def server(f, is_method=False):
         raise RuntimeError('Server code running on client')
     assert isinstance(f, str)
 
-    import json
-
     from functools import wraps
 
-    import pyodide
+    from .client import rpc
 
     server_key = f
 
     def _d(f):
+        if stream:
+            @wraps(f)
+            def _stream_wrapper(*args, **kwargs):
+                # Strip away `self`
+                if is_method:
+                    args = args[1:]
+
+                return rpc.stream(server_key, args, kwargs)
+
+            return _stream_wrapper
+
         @wraps(f)
         async def _wrapper(*args, **kwargs):
             print('Calling', server_key)
@@ -72,12 +139,7 @@ def server(f, is_method=False):
             if is_method:
                 args = args[1:]
 
-            result = await pyodide.http.pyfetch(f'/_c/{server_key}',
-                method='POST',
-                body=json.dumps({'a': args, 'k': kwargs})
-            )
-            result_json = await result.json()
-            return result_json['r']
+            return await rpc.call(server_key, args, kwargs)
 
         return _wrapper
 
@@ -1,22 +1,36 @@
 from __future__ import annotations
 
 import ast
+import filecmp
+import functools
+import gzip
 import hashlib
+import importlib.util
+import inspect
 import json
+import marshal
+import os
+import re
+import shutil
 import subprocess
 import sys
+import time
 import urllib.parse
+import zlib
 
-from collections import defaultdict
-from pathlib import Path
-from typing import Union
-from zipfile import ZipFile
+from collections import Counter, defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path, PurePosixPath
+from typing import Optional, Union
+from zipfile import ZIP_DEFLATED, ZIP_STORED, BadZipFile, ZipFile
 
 import build
 import pkg_resources
 import tomli
 
-from . import env
+from . import env, manifest
 from .client import html as H
 
 DEFAULT_CLIENT_NPM_PACKAGES = {
@@ -30,6 +44,66 @@ DEFAULT_BUILD_NPM_PACKAGES = {
     'esbuild': '0.17.8',
 }
 
+CACHE_DIR = Path('.brickie/cache')
+
+# Outside the build directory, which is served as static files
+BUILD_LOG_PATH = Path('.brickie/build.log')
+
+# Min uncached modules to transform in a process pool instead of serially
+PARALLEL_TRANSFORM_MIN_MODULES = 16
+
+# Pyodide (major, minor) -> Python (major, minor) it is built with
+PYODIDE_PYTHON_VERSIONS = {
+    (0, 22): (3, 10),
+    (0, 23): (3, 11),
+    (0, 24): (3, 11),
+    (0, 25): (3, 11),
+    (0, 26): (3, 12),
+    (0, 27): (3, 12),
+}
+
+# Python (major, minor) -> bytecode magic number
+PYTHON_MAGIC_NUMBERS = {
+    (3, 10): 3439,
+    (3, 11): 3495,
+    (3, 12): 3531,
+}
+
+# Assets smaller than this are not precompressed
+PRECOMPRESS_MIN_SIZE = 1024
+
+# Suffix of precompressed asset sibling -> Content-Encoding it is served with
+PRECOMPRESS_ENCODINGS = {
+    '.br': 'br',
+    '.gz': 'gzip',
+}
+
+# Hex digits of content hash added to asset filenames
+ASSET_HASH_LENGTH = 16
+
+HASHED_ASSET_RE = re.compile(
+    rf'(^|/)([0-9a-f]{{{ASSET_HASH_LENGTH}}}/[^/]+\.whl|[^/]+\.[0-9a-f]{{{ASSET_HASH_LENGTH}}}\.[^./]+)$'
+)
+
+# Directories excluded when fingerprinting editable dependency source trees
+TREE_IGNORE_DIRS = {
+    '.git', '.hg', '.brickie', '__pycache__', 'node_modules',
+    '.pytest_cache', '.mypy_cache', '.ruff_cache', '.tox', '.nox', '.venv', 'venv', 'build', 'dist',
+}
+
+
+def is_generator(node: Union[ast.FunctionDef, ast.AsyncFunctionDef]) -> bool:
+    # Search function body for yields, excluding nested scopes
+    nodes = list(node.body)
+    while nodes:
+        child = nodes.pop()
+        if isinstance(child, (ast.Yield, ast.YieldFrom)):
+            return True
+        if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef)):
+            continue
+        nodes.extend(ast.iter_child_nodes(child))
+    return False
+
 
 class ClientNodeTransformer(ast.NodeTransformer):
     def __init__(self, module_name: str, module_path: Path, src: str) -> None:
@@ -39,30 +113,46 @@ class ClientNodeTransformer(ast.NodeTransformer):
         self.src = src
         self.qualname_stack = []
 
+        # Names referenced by server functions, which are removed from client source
+        self.server_names = set()
+
     def visit_decorated(self, node: Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef]):
         for i, d in enumerate(node.decorator_list):
+            # Server options such as `@server(cache=...)` only apply on the server
+            if isinstance(d, ast.Call):
+                d = d.func
             if isinstance(d, ast.Name) and d.id == 'server':
+                self.server_names.update(n.id for n in ast.walk(node) if isinstance(n, ast.Name))
+
                 # Classes are removed completely
                 if isinstance(node, ast.ClassDef):
                     return None
 
-                # Only async supported for now
-                if isinstance(node, ast.FunctionDef):
-                    raise RuntimeError('Only async server functions supported')
+                # Sync functions are run in a thread pool on the server, only async can stream
+                if isinstance(node, ast.FunctionDef) and is_generator(node):
+                    raise RuntimeError('Only async generator server functions supported for streaming')
 
-                # Insert server decorator key into tree
-                src = ast.get_source_segment(self.src, node).strip()
+                # Insert server decorator key into tree, reusing key computed on import if module unchanged
                 qual_name = '.'.join(self.qualname_stack + [node.name])
-                unique_id = f'{self.module_name}|{qual_name}|{src}'
-                key = hashlib.sha256(unique_id.encode('utf-8')).hexdigest()
+                key = manifest.get_key(self.module_path, self.module_name, qual_name, recorded=True)
+                if key is None:
+                    src = ast.get_source_segment(self.src, node).strip()
+                    unique_id = f'{self.module_name}|{qual_name}|{src}'
+                    key = hashlib.sha256(unique_id.encode('utf-8')).hexdigest()
+                keywords = [
+                    ast.keyword('is_method', ast.Constant(
+                        bool(self.qualname_stack and '<locals>' not in self.qualname_stack[-1]))
+                    ),
+                ]
+
+                # Async generators are streamed to the client
+                if is_generator(node):
+                    keywords.append(ast.keyword('stream', ast.Constant(True)))
+
                 node.decorator_list[i] = ast.Call(
                     func=ast.Name(id='server'),
                     args=[ast.Constant(key)],
-                    keywords=[
-                        ast.keyword('is_method', ast.Constant(
-                            bool(self.qualname_stack and '<locals>' not in self.qualname_stack[-1]))
-                        ),
-                    ],
+                    keywords=keywords,
                 )
                 node.body = [ast.Pass()]
                 break
@@ -111,6 +201,100 @@ class ClientNodeTransformer(ast.NodeTransformer):
         return self.generic_visit(node)
 
 
+def has_call(*nodes: Optional[ast.AST]) -> bool:
+    return any(isinstance(child, ast.Call) for node in nodes if node is not None for child in ast.walk(node))
+
+
+def get_bound_names(node: ast.stmt) -> set[str]:
+    # Names bound by a module level statement, empty if not safe to remove. Decorators, class bodies
+    # and calls can have side effects, such as registering routes or components, so are always kept
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        if node.decorator_list or has_call(node.args, node.returns):
+            return set()
+        return {node.name}
+    if (
+        isinstance(node, ast.Assign) and
+        all(isinstance(t, ast.Name) for t in node.targets) and
+        not has_call(node.value)
+    ):
+        return {t.id for t in node.targets}
+    if (
+        isinstance(node, ast.AnnAssign) and
+        isinstance(node.target, ast.Name) and
+        node.value is not None and
+        not has_call(node.value, node.annotation)
+    ):
+        return {node.target.id}
+    return set()
+
+
+def get_referenced_names(node: ast.AST) -> set[str]:
+    names = set()
+    for child in ast.walk(node):
+        if isinstance(child, ast.Name):
+            names.add(child.id)
+        elif isinstance(child, (ast.Global, ast.Nonlocal)):
+            names.update(child.names)
+    return names
+
+
+def strip_server_only_names(module: ast.Module, server_names: set[str]) -> list[str]:
+    # Remove module level imports and definitions only referenced by server functions,
+    # including those only referenced by other removed statements
+    exported = set()
+    for node in module.body:
+        if isinstance(node, ast.Assign) and any(isinstance(t, ast.Name) and t.id == '__all__' for t in node.targets):
+            exported.update(c.value for c in ast.walk(node.value) if isinstance(c, ast.Constant))
+
+    candidates = set(server_names) - exported
+    stripped = []
+    changed = True
+    while changed:
+        changed = False
+        statement_refs = [get_referenced_names(node) for node in module.body]
+        ref_counts = Counter(name for refs in statement_refs for name in refs)
+
+        def is_unused(name: str, refs: set[str]) -> bool:
+            # Not referenced by any statement other than the one binding it
+            return name in candidates and ref_counts[name] - (name in refs) == 0
+
+        body = []
+        for node, refs in zip(module.body, statement_refs):
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                if any(alias.name == '*' for alias in node.names) or getattr(node, 'module', None) == '__future__':
+                    body.append(node)
+                    continue
+                names = [
+                    alias for alias in node.names
+                    if not is_unused((alias.asname or alias.name).split('.')[0], refs)
+                ]
+                if len(names) < len(node.names):
+                    removed = [alias for alias in node.names if alias not in names]
+                    if isinstance(node, ast.Import):
+                        stripped.append(ast.unparse(ast.Import(names=removed)))
+                    else:
+                        stripped.append(ast.unparse(ast.ImportFrom(node.module, removed, node.level)))
+                    changed = True
+                if names:
+                    node.names = names
+                    body.append(node)
+                continue
+
+            bound = get_bound_names(node)
+            if bound and all(is_unused(name, refs) for name in bound):
+                if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    stripped.append(f'def {node.name}')
+                else:
+                    stripped.append(', '.join(sorted(bound)) + ' =')
+                candidates |= refs
+                changed = True
+                continue
+            body.append(node)
+        module.body = body
+
+    return stripped
+
+
 def get_config(section='tool.brickie'):
     with open('pyproject.toml', 'rb') as fp:
         config = tomli.load(fp)
@@ -125,6 +309,22 @@ def get_config(section='tool.brickie'):
         config['tool']['brickie']['umd_packages'] = ()
     if 'styles' not in config['tool']['brickie']:
         config['tool']['brickie']['styles'] = ()
+    if 'rpc_transport' not in config['tool']['brickie']:
+        config['tool']['brickie']['rpc_transport'] = 'batch'
+    if 'bytecode' not in config['tool']['brickie']:
+        config['tool']['brickie']['bytecode'] = 'off'
+    if 'rpc_encoding' not in config['tool']['brickie']:
+        config['tool']['brickie']['rpc_encoding'] = 'json'
+    if 'bundle_compression_level' not in config['tool']['brickie']:
+        config['tool']['brickie']['bundle_compression_level'] = 6
+    if 'thread_pool_size' not in config['tool']['brickie']:
+        config['tool']['brickie']['thread_pool_size'] = None
+    if 'process_pool_size' not in config['tool']['brickie']:
+        config['tool']['brickie']['process_pool_size'] = None
+    if 'process_timeout' not in config['tool']['brickie']:
+        config['tool']['brickie']['process_timeout'] = None
+    if 'process_max_tasks' not in config['tool']['brickie']:
+        config['tool']['brickie']['process_max_tasks'] = None
 
     keys = list(section.split('.'))
     while keys:
@@ -205,7 +405,7 @@ def generate_imports_entry(use_cdn=False) -> list[str]:
     return imports
 
 
-def build_package_json(target_dir):
+def build_package_json(target_dir) -> str:
     config = get_config()
     pkg_config = parse_npm_package_config(config['npm_packages'], DEFAULT_BUILD_NPM_PACKAGES)
     out = {
@@ -213,20 +413,134 @@ def build_package_json(target_dir):
         'version': '0.0.1',
         'dependencies': pkg_config,
     }
-    (Path(target_dir) / 'package.json').write_text(json.dumps(out))
+    out = json.dumps(out)
+    (Path(target_dir) / 'package.json').write_text(out)
+    return out
 
 
-def build_import_modules(target_dir):
+def get_fingerprint(*inputs: str) -> str:
+    return hashlib.sha256('\0'.join(inputs).encode('utf-8')).hexdigest()
+
+
+def write_build_log(message: str):
+    BUILD_LOG_PATH.parent.mkdir(exist_ok=True, parents=True)
+    with open(BUILD_LOG_PATH, 'at') as fp:
+        fp.write(f'{datetime.now().isoformat(timespec="seconds")} {message}\n')
+
+
+def get_archive_sizes(zip_path: Path) -> dict[str, dict[str, int]]:
+    with ZipFile(zip_path) as zf:
+        return {
+            i.filename: {'size': i.file_size, 'compressed_size': i.compress_size}
+            for i in zf.infolist()
+        }
+
+
+def get_npm_package_sizes(metafile_path: Path) -> dict[str, dict[str, int]]:
+    # Output file -> npm package -> bytes contributed, from esbuild metafile
+    metafile = json.loads(Path(metafile_path).read_text())
+    sizes = {}
+    for output_name, output in metafile['outputs'].items():
+        package_sizes = defaultdict(int)
+        for input_name, input_info in output['inputs'].items():
+            if 'node_modules/' in input_name:
+                package_path = input_name.rsplit('node_modules/', 1)[1].split('/')
+                package = '/'.join(package_path[:2] if package_path[0].startswith('@') else package_path[:1])
+            else:
+                package = '(generated)'
+            package_sizes[package] += input_info['bytesInOutput']
+        sizes[output_name] = dict(sorted(package_sizes.items(), key=lambda p: p[1], reverse=True))
+    return sizes
+
+
+class BuildProfile:
+    # Stage timings of a build, reported with sizes of built assets by `brickie build --profile`
+
+    def __init__(self) -> None:
+        self.stages: dict[str, float] = {}
+        self.skipped_stages: list[str] = []
+        self.module_times: dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = time.perf_counter() - start
+
+    def to_dict(self, target_dir) -> dict:
+        target_dir = Path(target_dir)
+        archive_paths = [target_dir / 'dist.zip', *sorted((target_dir / 'chunks').glob('*.zip'))]
+        metafile_path = target_dir / 'esbuild-meta.json'
+        return {
+            'stages': self.stages,
+            'skipped_stages': self.skipped_stages,
+            'module_times': dict(sorted(self.module_times.items(), key=lambda m: m[1], reverse=True)),
+            'archives': {
+                p.relative_to(target_dir).as_posix(): get_archive_sizes(p)
+                for p in archive_paths
+                if p.exists() and not is_hashed_asset(p.name)
+            },
+            'npm_packages': get_npm_package_sizes(metafile_path) if metafile_path.exists() else {},
+        }
+
+
+def print_build_profile(data: dict, limit: int = 10):
+    lines = ['Stages:']
+    lines.extend(f'  {name}: {t:.3f}s' for name, t in data['stages'].items())
+    lines.extend(f'  {name}: skipped' for name in data['skipped_stages'])
+
+    lines.append('Slowest module transforms:')
+    lines.extend(f'  {name}: {t:.3f}s' for name, t in list(data['module_times'].items())[:limit])
+
+    for archive_name, files in data['archives'].items():
+        size = sum(f['size'] for f in files.values())
+        compressed_size = sum(f['compressed_size'] for f in files.values())
+        lines.append(f'{archive_name}: {size / 1024:.1f} KiB, {compressed_size / 1024:.1f} KiB compressed')
+        largest = sorted(files.items(), key=lambda f: f[1]['compressed_size'], reverse=True)[:limit]
+        lines.extend(
+            f'  {name}: {f["size"] / 1024:.1f} KiB, {f["compressed_size"] / 1024:.1f} KiB compressed'
+            for name, f in largest
+        )
+
+    for output_name, packages in data['npm_packages'].items():
+        lines.append(f'{output_name}: {sum(packages.values()) / 1024:.1f} KiB')
+        lines.extend(f'  {name}: {size / 1024:.1f} KiB' for name, size in list(packages.items())[:limit])
+
+    print('\n'.join(lines))
+
+
+def build_import_modules(target_dir, force=False, profile: Optional[BuildProfile] = None):
     target_dir = Path(target_dir)
-
-    build_package_json(target_dir)
-    subprocess.run(['npm', 'install'], cwd=target_dir)
+    profile = profile or BuildProfile()
+
+    # Fingerprints of inputs to last successful run of each stage
+    state_path = target_dir / 'import_modules.json'
+    try:
+        state = json.loads(state_path.read_text())
+    except (OSError, ValueError):
+        state = {}
+
+    package_json = build_package_json(target_dir)
+    install_fingerprint = get_fingerprint(package_json)
+    if not force and state.get('npm_install') == install_fingerprint and (target_dir / 'node_modules').exists():
+        write_build_log(f'npm install skipped, fingerprint {install_fingerprint}')
+        profile.skipped_stages.append('npm_install')
+    else:
+        with profile.stage('npm_install'):
+            result = subprocess.run(['npm', 'install'], cwd=target_dir)
+        state['npm_install'] = install_fingerprint if result.returncode == 0 else None
+        write_build_log(f'npm install ran, fingerprint {install_fingerprint}')
 
     gen_dir = target_dir / 'generated'
     gen_dir.mkdir(exist_ok=True)
-    (gen_dir / 'imports.mjs').write_text(';'.join(generate_imports_entry()))
-    (gen_dir / 'pyodide.mjs').write_text(';'.join(generate_pyodide_entry()))
-    subprocess.run([
+    imports_entry = ';'.join(generate_imports_entry())
+    pyodide_entry = ';'.join(generate_pyodide_entry())
+    (gen_dir / 'imports.mjs').write_text(imports_entry)
+    (gen_dir / 'pyodide.mjs').write_text(pyodide_entry)
+
+    esbuild_args = [
         'npx',
         'esbuild',
         'generated/imports.mjs',
@@ -234,69 +548,616 @@ def build_import_modules(target_dir):
         '--format=esm',
         '--bundle',
         '--outdir=./bundle',
-    ], cwd=target_dir)
+        '--metafile=esbuild-meta.json',
+    ]
+    esbuild_fingerprint = get_fingerprint(install_fingerprint, imports_entry, pyodide_entry, *esbuild_args)
+    if not force and state.get('esbuild') == esbuild_fingerprint and (target_dir / 'bundle').exists():
+        write_build_log(f'esbuild skipped, fingerprint {esbuild_fingerprint}')
+        profile.skipped_stages.append('esbuild')
+    else:
+        with profile.stage('esbuild'):
+            result = subprocess.run(esbuild_args, cwd=target_dir)
+        state['esbuild'] = esbuild_fingerprint if result.returncode == 0 else None
+        write_build_log(f'esbuild ran, fingerprint {esbuild_fingerprint}')
+
+    state_path.write_text(json.dumps(state))
 
 
-def build_client_source(module_name: str, module_path: Path) -> str:
-    src = module_path.read_text()
+def build_client_source(module_name: str, module_path: Path, src: Optional[str] = None) -> str:
+    return transform_client_source(module_name, module_path, src)[0]
+
+
+def transform_client_source(module_name: str, module_path: Path, src: Optional[str] = None) -> tuple[str, list[str]]:
+    # Client source, and server only names stripped from it
+    if src is None:
+        src = module_path.read_text()
     ast_node = compile(
         source=src,
         filename=module_path,
         mode='exec',
         flags=ast.PyCF_ONLY_AST,
     )
-    ast_node = ClientNodeTransformer(module_name, module_path, src).visit(ast_node)
-    return ast.unparse(ast_node)
+    transformer = ClientNodeTransformer(module_name, module_path, src)
+    ast_node = transformer.visit(ast_node)
+    stripped = strip_server_only_names(ast_node, transformer.server_names)
+    return ast.unparse(ast_node), stripped
+
+
+@functools.lru_cache()
+def get_transform_version() -> str:
+    # Include transformer source so editable brickie installs don't reuse stale output
+    version = pkg_resources.get_distribution('brickie').version
+    transformer_src = Path(__file__).read_bytes()
+    return hashlib.sha256(version.encode('utf-8') + transformer_src).hexdigest()
 
 
-def build_bundle(target_dir: Path, entry_module: str):
+def get_transform_cache_path(module_name: str, src: bytes, cache_dir: Path = CACHE_DIR) -> Path:
+    unique_id = b'|'.join([get_transform_version().encode('utf-8'), module_name.encode('utf-8'), src])
+    key = hashlib.sha256(unique_id).hexdigest()
+    return Path(cache_dir) / 'transform' / module_name / f'{key}.py'
+
+
+def build_client_source_cached(module_name: str, module_path: Path, cache_dir: Path = CACHE_DIR) -> str:
+    src = module_path.read_bytes()
+    cache_path = get_transform_cache_path(module_name, src, cache_dir)
+    if cache_path.exists():
+        return cache_path.read_text()
+
+    out, stripped = transform_client_source(module_name, module_path, src.decode('utf-8'))
+
+    # Only keep latest transform for each module
+    cache_path.parent.mkdir(exist_ok=True, parents=True)
+    for stale_path in [*cache_path.parent.glob('*.py'), *cache_path.parent.glob('*.json')]:
+        stale_path.unlink(missing_ok=True)
+
+    # Build metadata is kept beside the cached output, so it isn't shipped to clients
+    cache_path.with_suffix('.json').write_text(json.dumps({'stripped': stripped}))
+    tmp_path = cache_path.with_suffix('.tmp')
+    tmp_path.write_text(out)
+    os.replace(tmp_path, cache_path)
+    return out
+
+
+def get_stripped_names(module_name: str, module_path: Path, cache_dir: Path = CACHE_DIR) -> list[str]:
+    # Server only names stripped by the cached transform of module
+    cache_path = get_transform_cache_path(module_name, module_path.read_bytes(), cache_dir)
+    try:
+        return json.loads(cache_path.with_suffix('.json').read_text())['stripped']
+    except (OSError, ValueError, KeyError):
+        return []
+
+
+def _build_client_source_timed(module_name: str, module_path: Path, cache_dir: Path) -> tuple[str, float]:
+    start = time.perf_counter()
+    out = build_client_source_cached(module_name, module_path, cache_dir)
+    return out, time.perf_counter() - start
+
+
+def transform_modules(
+    modules: dict[str, Path],
+    cache_dir: Path = CACHE_DIR,
+    max_workers: Optional[int] = None,
+) -> dict[str, tuple[str, float]]:
+    # Module name -> (transformed source, seconds), cached modules are read in this process
+    results = {}
+    uncached = {}
+    for module_name, module_path in modules.items():
+        start = time.perf_counter()
+        cache_path = get_transform_cache_path(module_name, module_path.read_bytes(), cache_dir)
+        if cache_path.exists():
+            results[module_name] = (cache_path.read_text(), time.perf_counter() - start)
+        else:
+            uncached[module_name] = module_path
+
+    # Transforms are pure CPU work, only worth the process pool start up for larger batches
+    names = list(uncached)
+    paths = list(uncached.values())
+    cache_dirs = [cache_dir] * len(uncached)
+    if len(uncached) < PARALLEL_TRANSFORM_MIN_MODULES:
+        results.update(zip(names, map(_build_client_source_timed, names, paths, cache_dirs)))
+    else:
+        max_workers = max_workers or os.cpu_count()
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            chunksize = max(1, len(uncached) // (max_workers * 4))
+            results.update(zip(names, pool.map(_build_client_source_timed, names, paths, cache_dirs, chunksize=chunksize)))
+
+    return results
+
+
+def get_target_python_version() -> tuple[int, int]:
+    config = get_config()
+    pkg_config = parse_npm_package_config(config['npm_packages'], DEFAULT_BUILD_NPM_PACKAGES)
+    pyodide_version = tuple(int(v) for v in pkg_config['pyodide'].split('.')[:2])
+    if pyodide_version not in PYODIDE_PYTHON_VERSIONS:
+        raise RuntimeError(f'Unknown Python version for Pyodide {pkg_config["pyodide"]}')
+    return PYODIDE_PYTHON_VERSIONS[pyodide_version]
+
+
+def check_bytecode_target(python_version: tuple[int, int]):
+    # Bytecode is only loadable by the same Python minor version, identified by its magic number
+    magic = int.from_bytes(importlib.util.MAGIC_NUMBER[:2], 'little')
+    if magic != PYTHON_MAGIC_NUMBERS[python_version]:
+        raise RuntimeError(
+            f'Bytecode build requires Python {python_version[0]}.{python_version[1]} to match target Pyodide, '
+            f'build interpreter is Python {sys.version_info[0]}.{sys.version_info[1]} (magic number {magic})'
+        )
+
+
+def compile_bytecode_cached(path: str, src: str, cache_dir: Optional[Path] = None) -> bytes:
+    src = src.encode('utf-8')
+
+    # Checked hash based pyc (PEP 552), as unpacked source mtimes don't match build, and
+    # sources rewritten by reload must invalidate the pyc alongside them
+    flags = (0b11).to_bytes(4, 'little')
+    unique_id = b'|'.join([importlib.util.MAGIC_NUMBER, flags, path.encode('utf-8'), src])
+    cache_path = Path(cache_dir or CACHE_DIR) / 'bytecode' / path / f'{hashlib.sha256(unique_id).hexdigest()}.pyc'
+    if cache_path.exists():
+        return cache_path.read_bytes()
+
+    code = compile(src, path, 'exec', dont_inherit=True)
+    out = b''.join([
+        importlib.util.MAGIC_NUMBER,
+        flags,
+        importlib.util.source_hash(src),
+        marshal.dumps(code),
+    ])
+
+    # Only keep latest bytecode for each module
+    cache_path.parent.mkdir(exist_ok=True, parents=True)
+    for stale_path in cache_path.parent.glob('*.pyc'):
+        stale_path.unlink(missing_ok=True)
+    cache_path.write_bytes(out)
+    return out
+
+
+def build_bytecode_entries(
+    entries: dict[str, str],
+    mode: str,
+    python_version: tuple[int, int],
+    cache_dir: Optional[Path] = None,
+) -> dict[str, Union[str, bytes]]:
+    if mode == 'off':
+        return entries
+    if mode not in ('alongside', 'only'):
+        raise ValueError(f'Unknown bytecode mode "{mode}"')
+    check_bytecode_target(python_version)
+
+    out = {}
+    cache_tag = f'cpython-{python_version[0]}{python_version[1]}'
+    for name, src in entries.items():
+        path = Path(name)
+        bytecode = compile_bytecode_cached(name, src, cache_dir)
+        if mode == 'alongside':
+            # Cached bytecode is used in place of compiling source on import
+            out[name] = src
+            out[str(path.parent / '__pycache__' / f'{path.stem}.{cache_tag}.pyc')] = bytecode
+        else:
+            # Sourceless module
+            out[str(path.with_suffix('.pyc'))] = bytecode
+    return out
+
+
+def write_zip(zip_path: Path, entries: dict[str, Union[str, bytes]], compress_level: int = 0) -> bool:
+    if not isinstance(compress_level, int) or not 0 <= compress_level <= 9:
+        raise ValueError('Expected bundle compression level between 0 and 9')
+    compress_type = ZIP_DEFLATED if compress_level else ZIP_STORED
+
+    # Sorted for deterministic archive output
+    data = {
+        name: entries[name].encode('utf-8') if isinstance(entries[name], str) else entries[name]
+        for name in sorted(entries)
+    }
+
+    # Skip writing if no entries changed
+    try:
+        with ZipFile(zip_path) as zf:
+            existing = {i.filename: (i.CRC, i.file_size, i.compress_type) for i in zf.infolist()}
+        if existing == {name: (zlib.crc32(d), len(d), compress_type) for name, d in data.items()}:
+            return False
+    except (OSError, BadZipFile):
+        pass
+
+    # Replace atomically, so a partially written archive is never served
+    tmp_path = zip_path.with_suffix('.tmp')
+    with ZipFile(tmp_path, 'w', compression=compress_type, compresslevel=compress_level or None) as zf:
+        for name, d in data.items():
+            zf.writestr(name, d)
+    os.replace(tmp_path, zip_path)
+    return True
+
+
+def get_module_imports(module_name: str, src: str, is_package: bool = False) -> set[str]:
+    # Absolute names of all modules a module may import, including from function scopes
+    package = module_name if is_package else module_name.rpartition('.')[0]
+    names = set()
+    for node in ast.walk(ast.parse(src)):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            base = node.module or ''
+            if node.level:
+                try:
+                    base = importlib.util.resolve_name('.' * node.level + base, package)
+                except (ImportError, ValueError):
+                    continue
+            names.add(base)
+            names.update(f'{base}.{alias.name}' for alias in node.names)
+
+    # Importing a submodule imports its parent packages
+    imports = set()
+    for name in names:
+        parts = name.split('.')
+        imports.update('.'.join(parts[:i]) for i in range(1, len(parts) + 1))
+    return imports
+
+
+def split_bundle(
+    module_imports: dict[str, set[str]],
+    entry_module: str,
+    lazy_modules: set[str],
+) -> tuple[set[str], dict[str, set[str]]]:
+    def reachable(module_name: str) -> set[str]:
+        seen = set()
+        stack = [module_name]
+        while stack:
+            name = stack.pop()
+            if name in seen or name not in module_imports:
+                continue
+            seen.add(name)
+            stack.extend(module_imports[name])
+        return seen
+
+    # Modules shared by more than one chunk are moved to core, along with their imports
+    core = reachable(entry_module)
+    while True:
+        chunks = {
+            m: reachable(m) - core
+            for m in lazy_modules
+            if m in module_imports and m not in core
+        }
+        counts = Counter(name for chunk in chunks.values() for name in chunk)
+        shared = {name for name, count in counts.items() if count > 1}
+        if not shared:
+            break
+        for name in shared:
+            core |= reachable(name)
+
+    # Modules not reachable from any entry point are kept in core
+    core |= set(module_imports).difference(*chunks.values())
+    return core, chunks
+
+
+def print_transform_report(module_times: dict[str, float], wall_time: float):
+    slowest = sorted(module_times.items(), key=lambda m: m[1], reverse=True)[:10]
+    report = (
+        f'Transformed {len(module_times)} modules in {wall_time:.3f}s, slowest: ' +
+        ', '.join(f'{name} ({t:.3f}s)' for name, t in slowest)
+    )
+    print(report)
+    write_build_log(report)
+
+
+@functools.lru_cache()
+def get_package_size(name: str) -> int:
+    # Installed size of a top level module or package, 0 if not found
+    try:
+        spec = importlib.util.find_spec(name)
+    except (ImportError, ValueError):
+        return 0
+    if spec is None:
+        return 0
+    if spec.submodule_search_locations:
+        return sum(
+            p.stat().st_size
+            for location in spec.submodule_search_locations
+            for p in Path(location).rglob('*')
+            if p.is_file() and '__pycache__' not in p.parts
+        )
+    if spec.origin and os.path.isfile(spec.origin):
+        return os.path.getsize(spec.origin)
+    return 0
+
+
+def print_strip_report(stripped: dict[str, list[str]], module_imports: dict[str, set[str]]):
+    stripped = {m: names for m, names in stripped.items() if names}
+    if not stripped:
+        return
+
+    # Estimate saving as the size of third party packages no longer imported by any client module
+    client_packages = {name.split('.')[0] for imports in module_imports.values() for name in imports}
+    client_packages |= {m.split('.')[0] for m in module_imports}
+    stripped_packages = {
+        match.group(1).split('.')[0]
+        for names in stripped.values()
+        for match in map(re.compile(r'^(?:from|import) (\w[\w.]*)').match, names)
+        if match
+    }
+    saved_packages = {
+        name: get_package_size(name)
+        for name in sorted(stripped_packages - client_packages - set(sys.stdlib_module_names))
+    }
+
+    lines = [
+        f'Stripped server only names from {len(stripped)} modules, '
+        f'estimated {sum(saved_packages.values()) / 1024:.1f} KiB saved' + (
+            ' (' + ', '.join(f'{name} {size / 1024:.1f} KiB' for name, size in saved_packages.items()) + ')'
+            if saved_packages else ''
+        )
+    ]
+    for module_name, names in sorted(stripped.items()):
+        lines.append(f'  {module_name}: {", ".join(names)}')
+    report = '\n'.join(lines)
+    print(report)
+    write_build_log(report)
+
+
+BundleInfo = namedtuple('BundleInfo', ['module_times', 'route_chunks'])
+
+
+def get_bundle_modules() -> tuple[dict[str, Path], list[Path]]:
+    # Client modules with components, and paths of modules outside client directories with server functions
+    from . import _endpoint_keys
+    from .client import react
+
+    files: dict[str, Path] = {}
+    react.build_bundle(files)
+
+    cwd = Path('.').absolute()
+    client_dirs = [cwd / d for d in get_config()['client_directories']]
+    for module_path in files.values():
+        if not any(module_path.is_relative_to(d) for d in client_dirs):
+            raise RuntimeError('Component found outside client directories')
+
+    stub_paths = [
+        module_path for module_path in _endpoint_keys
+        if not any(module_path.is_relative_to(d) for d in client_dirs)
+    ]
+    return files, stub_paths
+
+
+def build_stub_source(module_path: Path) -> str:
+    from . import _endpoint_keys, _endpoint_registry
+
+    src = ['from brickie import server']
+    for endpoint_key in _endpoint_keys[module_path.absolute()]:
+        endpoint = _endpoint_registry[endpoint_key]
+        stream = inspect.isasyncgenfunction(endpoint)
+        src.extend([
+            f'@server("{endpoint_key}", is_method=False, stream={stream})',
+            f'def {endpoint.__name__}(*args, **kwargs): ...'
+        ])
+    return '\n'.join(src)
+
+
+def is_bundle_changed(target_dir) -> bool:
+    # Whether modules included in the bundle differ from the last full build
+    try:
+        bundle_state = json.loads((Path(target_dir) / 'bundle.json').read_text())
+    except (OSError, ValueError):
+        return True
+    cwd = Path('.').absolute()
+    files, stub_paths = get_bundle_modules()
+    return (
+        bundle_state['modules'] != sorted(files) or
+        bundle_state['stubs'] != sorted(str(p.relative_to(cwd)) for p in stub_paths)
+    )
+
+
+def get_bundle_archives(target_dir) -> dict[str, str]:
+    # Path of each bundled module relative to working directory -> archive containing it
+    return json.loads((Path(target_dir) / 'bundle.json').read_text())['entries']
+
+
+def patch_bundle(target_dir, module_name: str, module_path: Path) -> Optional[str]:
+    # Replace a single module in its archive, returns its client source or None if not bundled
+    target_dir = Path(target_dir)
+    bundle_state = json.loads((target_dir / 'bundle.json').read_text())
+    cwd = Path('.').absolute()
+    if not module_path.absolute().is_relative_to(cwd):
+        return None
+    entry_name = str(module_path.absolute().relative_to(cwd))
+    archive_name = bundle_state['entries'].get(entry_name)
+    if archive_name is None:
+        return None
+
+    config = get_config()
+    if entry_name in bundle_state['stubs']:
+        src = build_stub_source(module_path.absolute())
+    else:
+        src = build_client_source_cached(module_name, module_path)
+
+    new_entries: dict[str, Union[str, bytes]] = {entry_name: src}
+    if config['bytecode'] != 'off':
+        new_entries = build_bytecode_entries(new_entries, config['bytecode'], get_target_python_version())
+
+    archive_path = target_dir / archive_name
+    with ZipFile(archive_path) as zf:
+        entries = {name: zf.read(name) for name in zf.namelist()}
+    write_zip(archive_path, {**entries, **new_entries}, config['bundle_compression_level'])
+    return src
+
+
+def build_bundle(target_dir: Path, entry_module: str) -> BundleInfo:
     # Add working directory to path
     if '' not in sys.path:
         sys.path = [''] + sys.path
     __import__(entry_module)
 
-    files: dict[str, Path] = defaultdict(list)
-    from .client import react
-    react.build_bundle(files)
+    # Lazy route modules are not imported by the entry module
+    from .client.router import LazyRoute, _route_tree
+    lazy_routes = [
+        item for item in (_route_tree.match(path).item for path in sorted(_route_tree.paths))
+        if isinstance(item, LazyRoute)
+    ]
+    for lazy_route in lazy_routes:
+        __import__(lazy_route.module_name)
 
     config = get_config()
     cwd = Path('.').absolute()
-    client_dirs = [cwd / d for d in config['client_directories']]
-
-    with ZipFile(target_dir / 'dist.zip', 'w') as zf:
-        # Build transformed client bundle from client directories
-        for module_name, module_path in files.items():
-            if not any(module_path.is_relative_to(d) for d in client_dirs):
-                raise RuntimeError('Component found outside client directories')
-            src = build_client_source(module_name, module_path)
-            rel_module_path = module_path.relative_to(cwd)
-            zf.writestr(str(rel_module_path), src)
-
-        # Build stubs for everything outside client directories
-        from . import _endpoint_keys, _endpoint_registry
-        for module_path in _endpoint_keys:
-            if any(module_path.is_relative_to(d) for d in client_dirs):
+    files, stub_paths = get_bundle_modules()
+
+    start = time.perf_counter()
+    transformed = transform_modules(files)
+    module_times = {module_name: t for module_name, (_, t) in transformed.items()}
+    print_transform_report(module_times, time.perf_counter() - start)
+
+    # Split route modules not needed by the entry module into chunks
+    module_imports = {
+        module_name: get_module_imports(module_name, src, files[module_name].name == '__init__.py')
+        for module_name, (src, _) in transformed.items()
+    }
+    print_strip_report(
+        {module_name: get_stripped_names(module_name, module_path) for module_name, module_path in files.items()},
+        module_imports,
+    )
+    core, chunks = split_bundle(
+        module_imports,
+        entry_module,
+        {lazy_route.module_name for lazy_route in lazy_routes},
+    )
+
+    entries: dict[str, str] = {
+        str(files[module_name].relative_to(cwd)): transformed[module_name][0]
+        for module_name in core
+    }
+    chunk_entries: dict[str, dict[str, str]] = {
+        chunk_name: {
+            str(files[module_name].relative_to(cwd)): transformed[module_name][0]
+            for module_name in chunk
+        }
+        for chunk_name, chunk in chunks.items()
+    }
+
+    # Build stubs for everything outside client directories
+    for module_path in stub_paths:
+        entries[str(module_path.relative_to(cwd))] = build_stub_source(module_path)
+
+    # Archive of each entry, so dev reloads can patch a single module
+    bundle_state = {
+        'modules': sorted(files),
+        'stubs': sorted(str(p.relative_to(cwd)) for p in stub_paths),
+        'entries': {
+            **{name: 'dist.zip' for name in entries},
+            **{
+                name: f'chunks/{chunk_name}.zip'
+                for chunk_name, e in chunk_entries.items()
+                for name in e
+            },
+        },
+    }
+    (Path(target_dir) / 'bundle.json').write_text(json.dumps(bundle_state))
+
+    if config['bytecode'] != 'off':
+        python_version = get_target_python_version()
+        entries = build_bytecode_entries(entries, config['bytecode'], python_version)
+        chunk_entries = {
+            chunk_name: build_bytecode_entries(e, config['bytecode'], python_version)
+            for chunk_name, e in chunk_entries.items()
+        }
+    compress_level = config['bundle_compression_level']
+    write_zip(Path(target_dir) / 'dist.zip', entries, compress_level)
+
+    chunks_dir = Path(target_dir) / 'chunks'
+    chunks_dir.mkdir(parents=True, exist_ok=True)
+    for chunk_path in chunks_dir.glob('*.zip'):
+        # Hashed copies are removed with assets of older builds
+        if chunk_path.stem not in chunk_entries and not is_hashed_asset(chunk_path.name):
+            chunk_path.unlink()
+    for chunk_name, e in chunk_entries.items():
+        write_zip(chunks_dir / f'{chunk_name}.zip', e, compress_level)
+
+    route_chunks = {
+        lazy_route.path: lazy_route.module_name
+        for lazy_route in lazy_routes
+        if lazy_route.module_name in chunk_entries
+    }
+    return BundleInfo(module_times, route_chunks)
+
+
+def get_hashed_asset_name(name: str, data_hash: str) -> str:
+    path = PurePosixPath(name)
+
+    # Wheel filenames are parsed by micropip, so the hash is added as a directory instead
+    if path.suffix == '.whl':
+        return str(path.parent / data_hash / path.name)
+    return str(path.with_name(f'{path.stem}.{data_hash}{path.suffix}'))
+
+
+def is_hashed_asset(name: str) -> bool:
+    return HASHED_ASSET_RE.search(name) is not None
+
+
+def build_hashed_assets(target_dir, names: list[str]) -> dict[str, str]:
+    target_dir = Path(target_dir)
+    manifest_path = target_dir / 'assets.json'
+    try:
+        previous_assets = json.loads(manifest_path.read_text())
+    except (OSError, ValueError):
+        previous_assets = {}
+
+    assets = {}
+    for name in names:
+        path = target_dir / name
+        if not path.exists():
+            continue
+        data_hash = hashlib.sha256(path.read_bytes()).hexdigest()[:ASSET_HASH_LENGTH]
+        hashed_name = get_hashed_asset_name(name, data_hash)
+        hashed_path = target_dir / hashed_name
+        if not hashed_path.exists():
+            hashed_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = hashed_path.with_name(hashed_path.name + '.tmp')
+            shutil.copy2(path, tmp_path)
+            os.replace(tmp_path, hashed_path)
+        assets[name] = hashed_name
+
+    # Assets of the previous build are kept for clients that loaded its index
+    keep = set(assets.values()) | set(previous_assets.values())
+    for root, dirs, files in os.walk(target_dir):
+        dirs[:] = [d for d in dirs if d != 'node_modules']
+        for file_name in files:
+            rel_name = (Path(root) / file_name).relative_to(target_dir).as_posix()
+            if not is_hashed_asset(rel_name) or rel_name in keep:
                 continue
-            src = ['from brickie import server']
-            for endpoint_key in _endpoint_keys[module_path.absolute()]:
-                endpoint_name = _endpoint_registry[endpoint_key].__name__
-                src.extend([
-                    f'@server("{endpoint_key}", is_method=False)',
-                    f'def {endpoint_name}(*args, **kwargs): ...'
-                ])
-            src = '\n'.join(src)
-            rel_module_path = module_path.relative_to(cwd)
-            zf.writestr(str(rel_module_path), src)
-
-
-def build_index(target_dir, dependencies=(), options=None) -> H.Tag:
+            (target_dir / rel_name).unlink()
+            if rel_name.endswith('.whl'):
+                # Remove hash directory of wheel
+                shutil.rmtree((target_dir / rel_name).parent, ignore_errors=True)
+
+    manifest_path.write_text(json.dumps(assets, indent=2, sort_keys=True))
+    return assets
+
+
+def build_index(target_dir, dependencies=(), options=None, profile: Optional[BuildProfile] = None) -> H.Tag:
+    profile = profile or BuildProfile()
     config = get_config()
     entry_module, entry_component = config['entry'].split(':')
-    build_bundle(target_dir, entry_module)
+    with profile.stage('build_bundle'):
+        bundle_info = build_bundle(target_dir, entry_module)
+    profile.module_times = bundle_info.module_times
     if options.get('build_import_modules', True):
-        build_import_modules(target_dir)
+        build_import_modules(target_dir, force=options.get('force', False), profile=profile)
+
+    # Assets are referenced by content hashed names, so they can be cached indefinitely
+    chunk_names = {m: f'chunks/{m}.zip' for m in bundle_info.route_chunks.values()}
+    dep_names = [dep[len('_s/'):] for dep in dependencies if dep.startswith('_s/')]
+    # Dev reloads patch assets in place, so the index is not rebuilt for each change
+    assets = {}
+    if not options.get('reload'):
+        with profile.stage('build_hashed_assets'):
+            assets = build_hashed_assets(target_dir, [
+                'dist.zip',
+                'bundle/imports.js',
+                *chunk_names.values(),
+                *dep_names,
+            ])
+    asset_urls = {name: f'_s/{hashed_name}' for name, hashed_name in assets.items()}
+    chunk_urls = {m: '/' + asset_urls.get(name, f'_s/{name}') for m, name in chunk_names.items()}
+    route_chunks = {path: chunk_urls[m] for path, m in bundle_info.route_chunks.items()}
 
-    install_deps = [f'await micropip.install("{dep}")' for dep in dependencies]
+    install_deps = [
+        f'await micropip.install("{asset_urls.get(dep[len("_s/"):], dep)}")'
+        for dep in dependencies
+    ]
     return H.html(
         H.head(
             H.style (
@@ -310,8 +1171,20 @@ def build_index(target_dir, dependencies=(), options=None) -> H.Tag:
                 H.div(_class='__loading-spinner'),
             ),
             H.script(type='module') (f'''
+                // Chunk for initial route is fetched alongside the core bundle
+                function matchRoute(route, path) {{
+                    let routeSegments = route.split('/').filter(Boolean);
+                    let pathSegments = path.split('/').filter(Boolean);
+                    return routeSegments.length == pathSegments.length && routeSegments.every(
+                        (segment, i) => segment[0] == ':' || segment == pathSegments[i]);
+                }}
+
                 async function load() {{
-                    let distPromise = fetch('_s/dist.zip');
+                    let distPromise = fetch('{asset_urls.get('dist.zip', '_s/dist.zip')}');
+                    let routeChunks = {json.dumps(route_chunks)};
+                    let chunkPromises = Object.entries(routeChunks)
+                        .filter(([route, ]) => matchRoute(route, window.location.pathname))
+                        .map(([, url]) => fetch(url));
 
                     async function installPackages() {{
                         let pyodide = await window.__pyodidePromise;
@@ -326,6 +1199,10 @@ def build_index(target_dir, dependencies=(), options=None) -> H.Tag:
                         let dist = await (await distPromise).arrayBuffer();
                         let pyodide = await window.__pyodidePromise;
                         await pyodide.unpackArchive(dist, 'zip');
+                        for (let chunkPromise of chunkPromises) {{
+                            let chunk = await (await chunkPromise).arrayBuffer();
+                            await pyodide.unpackArchive(chunk, 'zip');
+                        }}
                     }}
 
                     await Promise.all([
@@ -336,11 +1213,16 @@ def build_index(target_dir, dependencies=(), options=None) -> H.Tag:
                 window.__pyodidePromise = loadPyodide();
                 window.__loadPromise = load();
             '''),
-            H.script(type='module', src='_s/bundle/imports.js'),
+            H.script(type='module', src=asset_urls.get('bundle/imports.js', '_s/bundle/imports.js')),
             H.script(type='module') (f'''
                 let pyodide = await window.__pyodidePromise;
                 await window.__loadPromise;
                 await pyodide.runPythonAsync(`
+                    from brickie import env
+                    env.RPC_TRANSPORT = {config['rpc_transport']!r}
+                    env.RPC_ENCODING = {config['rpc_encoding']!r}
+                    from brickie.client import router
+                    router._chunk_urls.update({chunk_urls!r})
                     {
                         'from brickie.client.reloader import init; init()'
                         if options and options.get('reload')
@@ -355,6 +1237,45 @@ def build_index(target_dir, dependencies=(), options=None) -> H.Tag:
     )
 
 
+def get_tree_fingerprint(path: Path) -> str:
+    # Stat based, so unchanged trees are fingerprinted without reading every file
+    fingerprint = hashlib.sha256(str(path.absolute()).encode('utf-8'))
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(
+            d for d in dirs
+            if d not in TREE_IGNORE_DIRS and not d.endswith('.egg-info')
+        )
+        for name in sorted(files):
+            if name.endswith(('.pyc', '.pyo')):
+                continue
+            file_path = Path(root) / name
+            stat = file_path.stat()
+            rel_path = file_path.relative_to(path)
+            fingerprint.update(f'{rel_path}|{stat.st_size}|{stat.st_mtime_ns}\n'.encode('utf-8'))
+    return fingerprint.hexdigest()
+
+
+def build_wheel_cached(path: Path, target_dir: Path, cache_dir: Path = CACHE_DIR) -> Path:
+    # Keyed by full path, as editable dependencies in different directories can share a name
+    path_hash = hashlib.sha256(str(path.absolute()).encode('utf-8')).hexdigest()[:16]
+    project_cache_dir = Path(cache_dir) / 'wheels' / f'{path.absolute().name}-{path_hash}'
+    wheel_cache_dir = project_cache_dir / get_tree_fingerprint(path)
+
+    if not wheel_cache_dir.exists():
+        # Only keep wheel for latest source tree of each project
+        shutil.rmtree(project_cache_dir, ignore_errors=True)
+        tmp_dir = project_cache_dir / 'tmp'
+        build.ProjectBuilder(path).build('wheel', tmp_dir)
+        os.replace(tmp_dir, wheel_cache_dir)
+
+    # Copy with metadata so unchanged wheels keep the same mtime and browser cache validators
+    wheel_path = next(wheel_cache_dir.glob('*.whl'))
+    target_path = Path(target_dir) / wheel_path.name
+    if not target_path.exists() or not filecmp.cmp(wheel_path, target_path):
+        shutil.copy2(wheel_path, target_path)
+    return target_path
+
+
 def build_deps(target_dir) -> list[str]:
     config = get_config('project')
 
@@ -384,8 +1305,8 @@ def build_deps(target_dir) -> list[str]:
             if not link['dir_info']['editable']:
                 continue
             path = urllib.parse.urlparse(link['url']).path
-            build_path = build.ProjectBuilder(path).build('wheel', target_dir)
-            out.append(f'_s/deps/{Path(build_path).name}')
+            build_path = build_wheel_cached(Path(path), target_dir)
+            out.append(f'_s/deps/{build_path.name}')
             break
         else:
             out.append(dep.project_name)
@@ -393,13 +1314,73 @@ def build_deps(target_dir) -> list[str]:
     return out
 
 
+def build_compressed_assets(target_dir: Path, min_size: int = PRECOMPRESS_MIN_SIZE):
+    import brotli
+
+    encoders = {
+        '.br': lambda data: brotli.compress(data, quality=11),
+        '.gz': lambda data: gzip.compress(data, compresslevel=9, mtime=0),
+    }
+    for root, dirs, files in os.walk(target_dir):
+        dirs[:] = [d for d in dirs if d != 'node_modules']
+        for name in files:
+            path = Path(root) / name
+            if path.suffix in PRECOMPRESS_ENCODINGS:
+                if not path.with_suffix('').exists():
+                    path.unlink()
+                continue
+            # Wheels are already compressed archives
+            if path.suffix in ('.tmp', '.log', '.whl'):
+                continue
+
+            stat = path.stat()
+            if stat.st_size < min_size:
+                continue
+
+            # Siblings take the mtime of their asset, so unchanged assets are not compressed again
+            data = None
+            for suffix, encode in encoders.items():
+                sibling_path = path.with_name(path.name + suffix)
+                if sibling_path.exists() and sibling_path.stat().st_mtime_ns == stat.st_mtime_ns:
+                    continue
+                if data is None:
+                    data = path.read_bytes()
+                tmp_path = sibling_path.with_name(sibling_path.name + '.tmp')
+                tmp_path.write_bytes(encode(data))
+                os.utime(tmp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+                os.replace(tmp_path, sibling_path)
+
+
 def build_runtime(target_dir='.brickie/build', options=None):
     options = options or {}
     target_dir = Path(target_dir)
     target_dir.mkdir(exist_ok=True, parents=True)
 
-    deps = build_deps(target_dir=target_dir / 'deps')
-    with open(target_dir / 'index.html', 'wt') as fp:
-        index = build_index(target_dir, dependencies=deps, options=options).to_html()
-        out = '<!DOCTYPE html>' + index
-        fp.write(out)
+    profile = BuildProfile()
+    with profile.stage('build_deps'):
+        deps = build_deps(target_dir=target_dir / 'deps')
+    with profile.stage('build_index'):
+        index = build_index(target_dir, dependencies=deps, options=options, profile=profile).to_html()
+    out = '<!DOCTYPE html>' + index
+
+    # Unchanged index keeps its mtime, and so its ETag
+    index_path = target_dir / 'index.html'
+    if not index_path.exists() or index_path.read_text() != out:
+        index_path.write_text(out)
+
+    # Server loads endpoint keys from manifest on next start instead of hashing source
+    manifest.write()
+
+    # Remove build metadata written into the served directory by earlier versions
+    for name in ('build.log', 'endpoints.json'):
+        (target_dir / name).unlink(missing_ok=True)
+
+    # Compressing on every dev rebuild would delay reloads, stale siblings are not served
+    if not options.get('reload'):
+        with profile.stage('build_compressed_assets'):
+            build_compressed_assets(target_dir)
+
+    if options.get('profile'):
+        data = profile.to_dict(target_dir)
+        print_build_profile(data)
+        (target_dir.parent / 'profile.json').write_text(json.dumps(data, indent=2))
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import hashlib
+import time
+
+from collections import OrderedDict
+from typing import Any, Callable, Union
+
+from . import wire
+
+MISSING = object()
+
+# Endpoint key -> result cache
+_endpoint_caches: dict[str, ResultCache] = {}
+
+
+def _sort_dicts(value: Any) -> Any:
+    if isinstance(value, dict):
+        items = sorted(value.items(), key=lambda item: wire.dumps(item[0]))
+        return {k: _sort_dicts(v) for k, v in items}
+    if isinstance(value, (list, tuple)):
+        return [_sort_dicts(v) for v in value]
+    return value
+
+
+class ResultCache:
+    def __init__(self, ttl: float = 60.0, max_entries: int = 1024) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(params: dict) -> str:
+        # Normalize payload so equivalent arguments share an entry, binary encoding keeps value types
+        # so arguments such as b'x' and "b'x'" don't
+        return hashlib.sha256(wire.dumps(_sort_dicts([params['a'], params['k']]))).hexdigest()
+
+    def get(self, cache_key: str) -> Any:
+        entry = self.entries.get(cache_key)
+        if entry is not None:
+            expires, value = entry
+            if expires > time.monotonic():
+                self.entries.move_to_end(cache_key)
+                self.hits += 1
+                return value
+            del self.entries[cache_key]
+        self.misses += 1
+        return MISSING
+
+    def set(self, cache_key: str, value: Any):
+        self.entries[cache_key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(cache_key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+def invalidate(endpoint: Union[str, Callable]):
+    if not isinstance(endpoint, str):
+        from . import _endpoint_registry
+        endpoint = next(k for k, f in _endpoint_registry.items() if f is endpoint)
+    cache = _endpoint_caches.get(endpoint)
+    if cache is not None:
+        cache.clear()
+
+
+def get_stats() -> dict[str, dict[str, int]]:
+    return {
+        key: {'hits': cache.hits, 'misses': cache.misses, 'entries': len(cache.entries)}
+        for key, cache in _endpoint_caches.items()
+    }
@@ -11,46 +11,62 @@ def cli():
 
 
 @cli.command()
-def build():
-    bundle.build_runtime()
+@click.option('--force', default=False, is_flag=True, help='Run all build stages, even if inputs are unchanged')
+@click.option('--profile', default=False, is_flag=True, help='Print build timings and asset sizes, written to .brickie/profile.json')
+def build(force: bool, profile: bool):
+    bundle.build_runtime(options={
+        'force': force,
+        'profile': profile,
+    })
 
 
 @cli.command()
 @click.option('--host', default='127.0.0.1', help='Bind server to this host')
 @click.option('--port', default=5000, type=int, help='Bind server to this port')
 @click.option('--reload', default=False, is_flag=True, help='Enable auto-reload')
-def serve(host: str, port: int, reload: bool):
+@click.option('--threads', default=None, type=int, help='Thread pool size for sync server functions')
+@click.option('--processes', default=None, type=int, help='Process pool size for process server functions')
+@click.option('--force', default=False, is_flag=True, help='Run all build stages, even if inputs are unchanged')
+def serve(host: str, port: int, reload: bool, threads: int, processes: int, force: bool):
     import uvicorn
 
     from starlette.applications import Starlette
-    from starlette.staticfiles import StaticFiles
 
-    from . import _endpoint_registry
-    from .client.router import _route_tree
-    from .serve import create_endpoint, index
-
-    app = Starlette()
+    from . import _endpoint_options, executor
+    from .serve import PrecompressedStaticFiles, batch_endpoint, endpoint, get_index_routes, websocket_endpoint
 
     if reload:
         from . import dev
         env.IS_RELOAD_ENABLED = True
-        dev.watch_for_reload(app, Path('.'))
+        reloader = dev.Reloader(Path('.'))
+        app = Starlette(lifespan=reloader.lifespan)
+        app.add_websocket_route('/_dev/reloader', reloader.client_reloader)
+    else:
+        app = Starlette()
+
+    config = bundle.get_config()
+    executor.configure(
+        thread_pool_size=threads or config['thread_pool_size'],
+        process_pool_size=processes or config['process_pool_size'],
+        process_timeout=config['process_timeout'],
+        process_max_tasks=config['process_max_tasks'])
 
     bundle.build_runtime(options={
         'reload': reload,
+        'force': force,
     })
 
-    # Redirect client routes to index
-    for p in _route_tree.paths:
-        app.add_route(p, index)
-    app.add_route('/', index)
+    # Start process workers ahead of first call if any server functions use them
+    if any(o.get('executor') == 'process' for o in _endpoint_options.values()):
+        executor.get_process_pool().warm()
+
+    app.add_route('/_c', batch_endpoint, methods=['POST'])
+    app.add_route('/_c/{key}', endpoint, methods=['POST'])
+    if config['rpc_transport'] == 'websocket':
+        app.add_websocket_route('/_c/ws', websocket_endpoint)
 
-    for key, endpoint in _endpoint_registry.items():
-        app.add_route(
-            name=key,
-            path=f'/_c/{key}',
-            route=create_endpoint(endpoint),
-            methods=['POST'])
+    app.mount('/_s', PrecompressedStaticFiles(directory=Path('.brickie/build'), html=True))
 
-    app.mount('/_s', StaticFiles(directory=Path('.brickie/build'), html=True))
+    # Redirect client routes to index, after server routes so client `:param` routes can't shadow them
+    app.router.routes.extend(get_index_routes())
     uvicorn.run(app, host=host, port=port, log_level='info')
@@ -441,22 +441,24 @@ class ReactReloadWrapperComponent(ReactComponent):
         return cls._subclass_registry[module_name][component_name]
 
     @classmethod
-    def _reload(cls, module):
+    def _reload(cls, module) -> list[ReactReloadWrapperComponent]:
         assert cls._component_cls
         component_cls = getattr(module, cls._component_cls.__name__, None)
         if component_cls is None:
-            print(f'Unable to find `{component_cls.__name__}` in reloaded module')
-            return
+            print(f'Unable to find `{cls._component_cls.__name__}` in reloaded module')
+            return []
 
         # Clean up old and set new class
         cls._component_cls._remove_class()
         cls._component_cls = component_cls
 
-        # Update instances
+        # Instances are returned to be updated, so reloads of several modules render together
+        instances = []
         for instance in cls._instance_registry:
             instance._component_instance = None
             if instance._set_react_state is not None:
-                instance._update()
+                instances.append(instance)
+        return instances
 
     def on_unload(self):
         self._instance_registry.remove(self)
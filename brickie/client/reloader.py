@@ -1,66 +1,133 @@
+from __future__ import annotations
+
 import importlib
 import json
 import sys
 
 from pathlib import Path
+from typing import Optional
 
 import js
 
-from pyodide.ffi import create_proxy
+from pyodide.ffi import create_once_callable, create_proxy
 
 from .. import env
+from ..diff import apply_source_diff, get_source_hash
+from ..modules import get_module_index
 from .esm import _imports_cache
 from .react import ReactReloadWrapperComponent
 
+RECONNECT_DELAY_MS = 1000
 
-def init():
-    env.IS_RELOAD_ENABLED = True
+_connection: Optional[ReloaderConnection] = None
+
+
+class ReloaderConnection:
+    # Reconnects to the dev server, resuming from the last change sequence applied
 
-    # TODO: auto reconnect
-    loc = js.window.location
-    prot = 'wss:' if loc.protocol == 'https:' else 'ws:'
-    uri = f'{prot}//{loc.host}/_dev/reloader'
-    ws = js.WebSocket.new(uri)
+    def __init__(self) -> None:
+        self.instance_id: Optional[str] = None
+        self.sequence: Optional[int] = None
+        self.chunks: list[str] = []
+        self.module_index = get_module_index()
+        self.ws = None
 
-    def on_open(event):
+    def connect(self):
+        loc = js.window.location
+        prot = 'wss:' if loc.protocol == 'https:' else 'ws:'
+        self.ws = js.WebSocket.new(f'{prot}//{loc.host}/_dev/reloader')
+        self.ws.addEventListener('open', create_proxy(self.on_open))
+        self.ws.addEventListener('message', create_proxy(self.on_message))
+        self.ws.addEventListener('close', create_proxy(self.on_close))
+        js.window._reloader_websocket = self.ws
+
+    def on_open(self, event):
         print('Reloader WebSocket created ...')
+        self.ws.send(json.dumps({'i': self.instance_id, 'n': self.sequence, 'c': self.chunks}))
+
+    def on_close(self, event):
+        js.setTimeout(create_once_callable(self.connect), RECONNECT_DELAY_MS)
+
+    def add_chunk(self, module_name: str, sequence: Optional[int]):
+        # Server resends changes to the chunk made after sequence, as the fetch may have missed them
+        self.chunks.append(module_name)
+        if self.ws is not None and self.ws.readyState == js.WebSocket.OPEN:
+            self.ws.send(json.dumps({'c': [module_name], 'n': sequence}))
 
-    def on_message(event):
+    def on_message(self, event):
         event_data = json.loads(event.data)
-        change_type = event_data['c']
-        change_path = Path(event_data['p'])
-        src = event_data['s']
-        if change_type in (1, 2):
-            if not change_path.exists():
-                print(f'Added {change_path} ...')
+        if 'i' in event_data:
+            self.instance_id = event_data['i']
+        if event_data.get('x'):
+            print('Reloader missed changes, reloading page ...')
+            js.window.location.reload()
+            return
+
+        reload_order = list(event_data.get('r', []))
+        for file_data in event_data.get('f', []):
+            change_type = file_data['c']
+            change_path = Path(file_data['p'])
+            if change_type in (1, 2):
+                if 's' in file_data:
+                    src = file_data['s']
+                else:
+                    # Diffs apply to the previous version, otherwise the page is out of sync
+                    old_src = change_path.read_text() if change_path.exists() else None
+                    if old_src is None or get_source_hash(old_src) != file_data['b']:
+                        print(f'Reloader out of sync on {change_path}, reloading page ...')
+                        js.window.location.reload()
+                        return
+                    src = apply_source_diff(old_src, file_data['d'])
+
+                if not change_path.exists():
+                    print(f'Added {change_path} ...')
+                else:
+                    print(f'Updated {change_path} ...')
+                with open(change_path, 'wt') as fp:
+                    fp.write(src)
+
+                # Modules only loaded by the client are not in the server reload order
+                loaded_module = self.module_index.get(change_path)
+                if loaded_module and loaded_module.__name__ not in reload_order:
+                    reload_order.append(loaded_module.__name__)
+            elif change_type == 3:
+                raise NotImplementedError
             else:
-                print(f'Updated {change_path} ...')
-            with open(change_path, 'wt') as fp:
-                fp.write(src)
-
-            # Check if module is loaded and reload it
-            modules = {
-                Path(m.__file__): m
-                for m in sys.modules.values()
-                if getattr(m, '__file__', None)
-            }
-            loaded_module = modules.get(change_path.absolute())
+                raise RuntimeError('Unexpected change type')
+        if 'n' in event_data:
+            self.sequence = event_data['n']
+
+        # Reload changed modules and their dependents in server order, then render once
+        instances = []
+        for module_name in reload_order:
+            loaded_module = sys.modules.get(module_name)
             if not loaded_module:
-                return
+                continue
 
             with env._reload_context():
                 reloaded_module = importlib.reload(loaded_module)
 
                 # Find reload wrapper subclass for each component for reloaded module and reload
-                wrapper_subclasses = ReactReloadWrapperComponent._subclass_registry.get(reloaded_module.__name__)
+                wrapper_subclasses = ReactReloadWrapperComponent._subclass_registry.get(reloaded_module.__name__, {})
                 for wrapper_cls in wrapper_subclasses.values():
-                    wrapper_cls._reload(reloaded_module)
+                    instances.extend(wrapper_cls._reload(reloaded_module))
+
+        # Updates issued together are rendered by React in a single batch
+        for instance in dict.fromkeys(instances):
+            instance._update()
+
+
+def get_sequence() -> Optional[int]:
+    return _connection.sequence if _connection is not None else None
 
-        elif change_type == 3:
-            raise NotImplementedError
-        else:
-            raise RuntimeError('Unexpected change type')
 
-    ws.addEventListener('open', create_proxy(on_open))
-    ws.addEventListener('message', create_proxy(on_message))
-    js.window._reloader_websocket = ws
+def add_chunk(module_name: str, sequence: Optional[int]):
+    if _connection is not None:
+        _connection.add_chunk(module_name, sequence)
+
+
+def init():
+    global _connection
+    env.IS_RELOAD_ENABLED = True
+    _connection = ReloaderConnection()
+    _connection.connect()
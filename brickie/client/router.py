@@ -1,5 +1,9 @@
 from __future__ import annotations
 
+import asyncio
+import importlib
+import importlib.util
+
 from collections import namedtuple
 from typing import Generic, Optional, Type, TypeVar
 from weakref import WeakSet
@@ -16,6 +20,9 @@ ROUTE_TREE_PARAM_KEY = object()
 
 _router_registry: set[Router] = WeakSet()
 
+# Module name -> URL of its route chunk, set by index
+_chunk_urls: dict[str, str] = {}
+
 
 class RouteTree(Generic[T]):
     MatchedPath = namedtuple('MatchedPath', ['item', 'params'])
@@ -81,6 +88,66 @@ class RouteTree(Generic[T]):
         return current.pop(ROUTE_TREE_ITEM_KEY)
 
 
+class LazyRoute:
+    # Route to a component whose module is imported, and its chunk fetched, on first match
+    def __init__(self, path: str, target: str):
+        module_name, _, component_name = target.partition(':')
+        if not module_name or not component_name:
+            raise ValueError('Expected lazy route component as "module:Component"')
+        self.path = path
+        self.module_name = module_name
+        self.component_name = component_name
+        self.component: Optional[Type[TComponent]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def load(self) -> asyncio.Task:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._load())
+        return self._task
+
+    async def _load(self):
+        try:
+            is_unpacked = importlib.util.find_spec(self.module_name) is not None
+        except ModuleNotFoundError:
+            is_unpacked = False
+        if not is_unpacked:
+            try:
+                await load_chunk(self.module_name)
+            except Exception:
+                # Allow retry on next navigation
+                self._task = None
+                raise
+
+        module = importlib.import_module(self.module_name)
+        component = getattr(module, self.component_name)
+        assert issubclass(component, Component)
+        self.component = component
+        for r in _router_registry:
+            r._update()
+
+
+async def load_chunk(module_name: str):
+    import io
+    import zipfile
+
+    import pyodide.http
+
+    from . import reloader
+
+    # Dev reloader resends changes patched into the chunk after this sequence
+    sequence = reloader.get_sequence() if env.IS_RELOAD_ENABLED else None
+    url = _chunk_urls.get(module_name, f'/_s/chunks/{module_name}.zip')
+    response = await pyodide.http.pyfetch(url)
+    if not response.ok:
+        raise RuntimeError(f'Failed to load route chunk for {module_name}')
+    data = await response.bytes()
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        zf.extractall()
+    importlib.invalidate_caches()
+    if env.IS_RELOAD_ENABLED:
+        reloader.add_chunk(module_name, sequence)
+
+
 class Router(Component):
     root = prop()
 
@@ -96,8 +163,15 @@ class Router(Component):
             self._component_instance = None
             return f'Unmatched path {url_path}'
 
-        if matched.item is not self._component_cls:
-            self._component_cls = matched.item
+        component_cls = matched.item
+        if isinstance(component_cls, LazyRoute):
+            if component_cls.component is None:
+                component_cls.load()
+                return ''
+            component_cls = component_cls.component
+
+        if component_cls is not self._component_cls:
+            self._component_cls = component_cls
             self._component_instance = self._component_cls()
 
         return self._component_instance
@@ -109,10 +183,17 @@ class Router(Component):
         _router_registry.remove(self)
 
 
-def route(path: str):
+def route(path: str, component: Optional[str] = None):
     if not isinstance(path, str):
         raise ValueError('Expected route path to be a string')
 
+    # Lazy routes are split into their own bundle chunk, loaded when first navigated to
+    if component is not None:
+        if not isinstance(component, str):
+            raise ValueError('Expected lazy route component to be a string')
+        _route_tree.insert(path, LazyRoute(path, component))
+        return None
+
     def _d(component):
         assert issubclass(component, Component)
         _route_tree.insert(path, component)
@@ -124,6 +205,12 @@ def route(path: str):
 def navigate(path: str):
     import js
     js.window.history.pushState(None, None, path)
+
+    # Start fetching the route chunk before routers render
+    matched = _route_tree.match(path)
+    if matched is not None and isinstance(matched.item, LazyRoute):
+        matched.item.load()
+
     for r in _router_registry:
         r._update()
 
@@ -0,0 +1,182 @@
+import asyncio
+import itertools
+import json
+
+from typing import Optional
+
+import js
+import pyodide
+
+from pyodide.ffi import create_proxy, to_js
+
+from .. import env, wire
+
+# Calls issued in the current event loop tick, flushed together as one batch
+_pending_calls: list[tuple[str, dict, asyncio.Future]] = []
+
+# Shared WebSocket connection, calls are matched to responses by id
+_websocket: Optional[asyncio.Future] = None
+_websocket_calls: dict[int, asyncio.Future] = {}
+_websocket_call_ids = itertools.count()
+
+
+async def post(url: str, content: dict) -> dict:
+    if env.RPC_ENCODING == 'binary':
+        result = await pyodide.http.pyfetch(url,
+            method='POST',
+            body=wire.dumps(content),
+            headers={'Content-Type': wire.CONTENT_TYPE, 'Accept': wire.CONTENT_TYPE},
+        )
+    else:
+        result = await pyodide.http.pyfetch(url,
+            method='POST',
+            body=json.dumps(content),
+        )
+
+    if not result.ok:
+        raise RuntimeError(f'Server call failed: {result.status_text}')
+    if env.RPC_ENCODING == 'binary':
+        return wire.loads(await result.bytes())
+    return await result.json()
+
+
+async def fetch_call(server_key: str, params: dict):
+    result = await post(f'/_c/{server_key}', params)
+    return result['r']
+
+
+async def _flush_calls():
+    calls = list(_pending_calls)
+    _pending_calls.clear()
+
+    # Single call, no need for batch endpoint
+    if len(calls) == 1:
+        server_key, params, future = calls[0]
+        try:
+            future.set_result(await fetch_call(server_key, params))
+        except Exception as exc:
+            future.set_exception(exc)
+        return
+
+    try:
+        result = await post('/_c', {'c': [{'e': k, **p} for k, p, _ in calls]})
+    except Exception as exc:
+        for _, _, future in calls:
+            future.set_exception(exc)
+        return
+
+    for (_, _, future), call_result in zip(calls, result['r']):
+        if 'e' in call_result:
+            future.set_exception(RuntimeError(f'Server call failed: {call_result["e"]}'))
+        else:
+            future.set_result(call_result['r'])
+
+
+def batch_call(server_key: str, params: dict) -> asyncio.Future:
+    loop = asyncio.get_event_loop()
+    future = loop.create_future()
+    if not _pending_calls:
+        # Flush on next tick, collecting all calls issued in this one
+        loop.call_soon(lambda: loop.create_task(_flush_calls()))
+    _pending_calls.append((server_key, params, future))
+    return future
+
+
+def _connect_websocket() -> asyncio.Future:
+    loop = asyncio.get_event_loop()
+    connected = loop.create_future()
+
+    loc = js.window.location
+    prot = 'wss:' if loc.protocol == 'https:' else 'ws:'
+    ws = js.WebSocket.new(f'{prot}//{loc.host}/_c/ws')
+    ws.binaryType = 'arraybuffer'
+
+    def on_open(event):
+        connected.set_result(ws)
+
+    def on_message(event):
+        if isinstance(event.data, str):
+            result = json.loads(event.data)
+        else:
+            result = wire.loads(event.data.to_bytes())
+        future = _websocket_calls.pop(result['i'], None)
+        if future is None or future.done():
+            return
+        if 'e' in result:
+            future.set_exception(RuntimeError(f'Server call failed: {result["e"]}'))
+        else:
+            future.set_result(result['r'])
+
+    def on_close(event):
+        global _websocket
+        _websocket = None
+        if not connected.done():
+            connected.set_exception(RuntimeError('Unable to connect server WebSocket'))
+
+        for future in _websocket_calls.values():
+            if not future.done():
+                future.set_exception(RuntimeError('Server WebSocket closed'))
+        _websocket_calls.clear()
+
+    ws.addEventListener('open', create_proxy(on_open))
+    ws.addEventListener('message', create_proxy(on_message))
+    ws.addEventListener('close', create_proxy(on_close))
+    return connected
+
+
+async def websocket_call(server_key: str, params: dict):
+    global _websocket
+    if _websocket is None:
+        _websocket = _connect_websocket()
+
+    try:
+        ws = await _websocket
+    except RuntimeError:
+        # WebSocket unavailable, fall back to a request per call
+        return await fetch_call(server_key, params)
+
+    call_id = next(_websocket_call_ids)
+    future = asyncio.get_event_loop().create_future()
+    _websocket_calls[call_id] = future
+    message = {'i': call_id, 'e': server_key, **params}
+    if env.RPC_ENCODING == 'binary':
+        ws.send(to_js(wire.dumps(message)))
+    else:
+        ws.send(json.dumps(message))
+    return await future
+
+
+async def stream(server_key: str, args: tuple, kwargs: dict):
+    result = await pyodide.http.pyfetch(f'/_c/{server_key}',
+        method='POST',
+        body=json.dumps({'a': args, 'k': kwargs}),
+    )
+    if not result.ok:
+        raise RuntimeError(f'Server call failed: {result.status_text}')
+
+    reader = result.js_response.body.getReader()
+    try:
+        buffer = b''
+        while True:
+            chunk = await reader.read()
+            if chunk.done:
+                break
+            buffer += chunk.value.to_bytes()
+            *lines, buffer = buffer.split(b'\n')
+            for line in lines:
+                item = json.loads(line)
+                if 'e' in item:
+                    raise RuntimeError(f'Server call failed: {item["e"]}')
+                yield item['r']
+    finally:
+        # Stop reading if consumer exits early, server closes the generator on disconnect
+        reader.cancel()
+
+
+async def call(server_key: str, args: tuple, kwargs: dict):
+    params = {'a': args, 'k': kwargs}
+    if env.RPC_TRANSPORT == 'websocket':
+        return await websocket_call(server_key, params)
+    if env.RPC_TRANSPORT == 'batch':
+        return await batch_call(server_key, params)
+    return await fetch_call(server_key, params)
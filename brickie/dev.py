@@ -1,146 +1,416 @@
+import asyncio
 import importlib
-import inspect
+import json
+import secrets
 import sys
+import time
 import traceback
 
 from asyncio import Queue
-from collections import defaultdict
+from collections import defaultdict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
 from pathlib import Path
-from threading import Thread
+from typing import Callable, Optional
 from weakref import WeakKeyDictionary
 
 import websockets.exceptions
 
 from starlette.applications import Starlette
-from starlette.routing import Route
-from starlette.websockets import WebSocket
-from watchfiles import Change, DefaultFilter, watch
+from starlette.websockets import WebSocket, WebSocketDisconnect
+from watchfiles import Change, DefaultFilter, awatch
 
-from . import _endpoint_keys, _endpoint_registry, env
-from .bundle import build_client_source, build_runtime, get_config
-from .serve import create_endpoint
+from . import _endpoint_keys, _endpoint_options, _endpoint_registry, _endpoint_staging, env, executor
+from .bundle import build_runtime, get_bundle_archives, get_config, is_bundle_changed, patch_bundle
+from .cache import ResultCache, _endpoint_caches
+from .diff import diff_source, get_source_hash
+from .graph import ModuleGraph
+from .modules import get_module_index
+from .serve import get_index_routes, index
 
+# Max milliseconds to group changes, and milliseconds without changes before a batch is reloaded
+WATCH_DEBOUNCE_MS = 1600
+WATCH_STEP_MS = 50
 
-def watch_for_reload(app: Starlette, root_path: Path):
-    change_queues: dict[WebSocket, Queue] = WeakKeyDictionary()
+# Reloaded batches kept for reconnecting clients to resume from
+RELOAD_LOG_SIZE = 100
 
-    # module path -> set(route key)
-    module_keys: dict[Path, set[str]] = defaultdict(set)
-    for key, endpoint in _endpoint_registry.items():
-        path = Path(inspect.getfile(endpoint))
-        module_keys[path].add(key)
 
-    def watch_thread():
+def is_project_module(path: Path, root_path: Path) -> bool:
+    # Modules in project directory, excluding installed packages such as virtual environments
+    if not path.is_relative_to(root_path):
+        return False
+    parts = path.relative_to(root_path).parts
+    return not any(p in DefaultFilter.ignore_dirs or p in ('.brickie', 'site-packages') for p in parts)
+
+
+class EndpointChanges:
+    # Server functions registered by reloaded modules, staged on the reload thread and installed on the loop
+
+    def __init__(self) -> None:
+        self.registry: dict[str, Callable] = {}
+        self.keys: dict[Path, set[str]] = defaultdict(set)
+        self.options: dict[str, dict] = {}
+        self.caches: dict[str, ResultCache] = {}
+
+        # Paths of modules whose server functions are replaced on install
+        self.module_paths: set[Path] = set()
+
+        # Registry holds weak references, previous functions are kept alive for requests until install
+        self.previous: list[Callable] = []
+
+    @contextmanager
+    def staging(self):
+        _endpoint_staging.registry = (self.registry, self.keys, self.options, self.caches)
+        try:
+            yield
+        finally:
+            del _endpoint_staging.registry
+
+    def discard(self, module_path: Path):
+        for key in self.keys.pop(module_path, ()):
+            self.registry.pop(key, None)
+            self.options.pop(key, None)
+            self.caches.pop(key, None)
+        self.module_paths.discard(module_path)
+
+    def install(self):
+        # Run on the loop without awaiting, so requests see either all old or all new server functions
+        is_process_changed = False
+        for module_path in self.module_paths:
+            old_keys = set(_endpoint_keys[module_path])
+            new_keys = self.keys.get(module_path, set())
+            is_process_changed |= any(
+                (self.options.get(key) or _endpoint_options.get(key, {})).get('executor') == 'process'
+                for key in old_keys | new_keys
+            )
+            for key in old_keys:
+                _endpoint_registry.pop(key, None)
+                _endpoint_options.pop(key, None)
+                _endpoint_caches.pop(key, None)
+            for key in new_keys:
+                _endpoint_registry[key] = self.registry[key]
+                _endpoint_options[key] = self.options[key]
+                if key in self.caches:
+                    _endpoint_caches[key] = self.caches[key]
+            _endpoint_keys[module_path] = new_keys
+        self.previous.clear()
+
+        # Process workers hold the previous module code
+        if is_process_changed:
+            executor.recycle_process_pool()
+
+
+def reload_module(module, module_path: Path, change_type: Change, endpoints: EndpointChanges) -> bool:
+    # Server functions are registered into endpoints, replacing those of the module once installed
+    endpoints.discard(module_path)
+    endpoints.previous.extend(
+        f for f in map(_endpoint_registry.get, list(_endpoint_keys[module_path])) if f is not None
+    )
+    if change_type != Change.deleted:
+        with env._reload_context(), endpoints.staging():
+            try:
+                importlib.reload(module)
+            except Exception as exc:
+                traceback.print_exception(exc)
+
+                # Previous code is kept serving, along with its caches
+                endpoints.discard(module_path)
+                return False
+    endpoints.module_paths.add(module_path)
+    return True
+
+
+class ReloadBatch:
+    # Changes reloaded together, each file is serialized once and shared by all client messages
+
+    def __init__(self) -> None:
+        self.sequence = 0
+
+        # (archive, serialized diff, serialized source) of each patched file
+        self.files: list[tuple[str, str, str]] = []
+
+        # (module name, archive) of modules to reload, in reload order
+        self.reload_order: list[tuple[str, str]] = []
+        self._messages: dict[frozenset[str], str] = {}
+
+    def add_file(self, change_type: Change, path: str, archive: str, src: str, previous_src: Optional[str]):
+        full = json.dumps({'c': change_type, 'p': path, 's': src})
+        diff = full
+        if previous_src is not None:
+            diff = json.dumps({
+                'c': change_type,
+                'p': path,
+                'b': get_source_hash(previous_src),
+                'd': diff_source(previous_src, src),
+            })
+        self.files.append((archive, min(diff, full, key=len), full))
+
+    def get_message(self, archives: frozenset[str]) -> str:
+        # Clients that loaded the same archives share a message
+        message = self._messages.get(archives)
+        if message is None:
+            message = self._messages[archives] = self.serialize(archives)
+        return message
+
+    def serialize(self, archives: frozenset[str], is_replay: bool = False) -> Optional[str]:
+        # Replays resend full sources of archives loaded after the batch, without advancing the sequence
+        files = [full if is_replay else diff for archive, diff, full in self.files if archive in archives]
+        if is_replay and not files:
+            return None
+        reload_order = [module_name for module_name, archive in self.reload_order if archive in archives]
+        sequence = '' if is_replay else f'"n": {self.sequence}, '
+        return f'{{{sequence}"f": [{", ".join(files)}], "r": {json.dumps(reload_order)}}}'
+
+
+class ReloaderClient:
+    # Connected client, with the bundle archives it has loaded
+
+    def __init__(self) -> None:
+        self.queue: Queue[str] = Queue()
+        self.archives = frozenset({'dist.zip'})
+
+
+# Reloaded modules, with their server functions to install before the bundle is patched
+ReloadResult = namedtuple('ReloadResult', ['changed', 'reload_order', 'reloaded', 'endpoints', 'start'])
+
+
+class Reloader:
+    # Watches project files from the server event loop, module reloads are run in a worker thread
+
+    def __init__(self, root_path: Path, target_dir: Path = Path('.brickie/build')) -> None:
+        self.root_path = root_path.absolute()
+        self.target_dir = target_dir
+        self.graph = ModuleGraph()
+        self.graph_offset = 0
+        self.module_index = get_module_index()
+        self.clients: dict[WebSocket, ReloaderClient] = WeakKeyDictionary()
+        self.current_packages = get_config()['npm_packages']
+
+        # Clients resume from their last sequence, unless the server restarted since
+        self.instance_id = secrets.token_hex(8)
+        self.sequence = 0
+        self.log: deque[ReloadBatch] = deque(maxlen=RELOAD_LOG_SIZE)
+
+        # Path -> client source last sent, changes are sent as diffs against it
+        self.sources: dict[Path, str] = {}
+
+        # Single worker, so batches of changes are reloaded in order
+        self.reload_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='brickie-reload')
+
+    @asynccontextmanager
+    async def lifespan(self, app: Starlette):
+        stop_event = asyncio.Event()
+        task = asyncio.create_task(self.watch(app, stop_event))
+        try:
+            yield
+        finally:
+            stop_event.set()
+            await task
+            self.reload_executor.shutdown(wait=False, cancel_futures=True)
+
+    async def watch(self, app: Starlette, stop_event: asyncio.Event):
         ignore_dirs = DefaultFilter.ignore_dirs + ('.brickie', )
         watch_filter = DefaultFilter(ignore_dirs=ignore_dirs)
-        current_packages = get_config()['npm_packages']
+        loop = asyncio.get_running_loop()
 
-        for changes in watch(root_path, watch_filter=watch_filter, recursive=True):
+        # Changes during a reload are grouped into the next batch
+        async for changes in awatch(
+            self.root_path,
+            watch_filter=watch_filter,
+            debounce=WATCH_DEBOUNCE_MS,
+            step=WATCH_STEP_MS,
+            stop_event=stop_event,
+            recursive=True,
+        ):
             try:
-                build_runtime(options={
-                    'reload': True,
-                    'build_import_modules': False,
-                })
+                result = await loop.run_in_executor(self.reload_executor, self.reload_changes, changes)
+                if result is None:
+                    continue
+
+                # Applied on the loop together, so requests see either the old or the new server functions
+                # and routes. Reloaded modules are executed in place on the reload thread, requests keep
+                # calling the previous function objects until they are replaced here
+                result.endpoints.install()
+                app.router.routes = [
+                    *(r for r in app.router.routes if getattr(r, 'endpoint', None) is not index),
+                    *get_index_routes(),
+                ]
+
+                # Bundle is patched after install, as stubs are built from the registered server functions
+                batch = await loop.run_in_executor(self.reload_executor, self.build_batch, result)
             except Exception as exc:
                 traceback.print_exception(exc)
                 continue
 
-            for change in changes:
-                modules = {
-                    Path(m.__file__): m
-                    for m in sys.modules.values()
-                    if getattr(m, '__file__', None)
-                }
-                change_type, change_path = change
-                change_path = Path(change_path)
-
-                # If packages changes, full reload page
-                if change_path.name == 'pyproject.toml':
-                    new_packages = get_config()['npm_packages']
-                    if current_packages != new_packages:
-                        # TODO: full reload page
-                        print('Packages changed, full reload')
-                        build_runtime(options={
-                            'reload': True,
-                            'build_import_modules': True,
-                        })
-                        current_packages = new_packages
-                        continue
-
-                if change_path.suffix != '.py':
-                    continue
+            self.sequence += 1
+            batch.sequence = self.sequence
+            self.log.append(batch)
+            for client in self.clients.values():
+                client.queue.put_nowait(batch.get_message(client.archives))
 
-                # Get current route keys to be delete
-                # And clear endpoint registry for changed module
-                if change_type in (Change.modified, Change.deleted):
-                    to_delete_keys = set(module_keys[change_path])
-                    for key in to_delete_keys:
-                        _endpoint_registry.pop(key, None)
-                    _endpoint_keys[Path(change_path).absolute()].clear()
-                else:
-                    to_delete_keys = set()
-
-                # Reload module
-                loaded_module = modules.get(change_path)
-                if not loaded_module:
-                    continue
-                with env._reload_context():
-                    try:
-                        importlib.reload(loaded_module)
-                    except Exception as exc:
-                        traceback.print_exception(exc)
-                        continue
-
-                # Add new routes
-                module_keys[change_path] = set()
-                routes = {r.name: r for r in app.routes if isinstance(r, Route)}
-                for key, endpoint in _endpoint_registry.items():
-                    path = Path(inspect.getfile(endpoint))
-                    if path != change_path:
-                        continue
-
-                    assert key not in module_keys[path]
-                    module_keys[path].add(key)
-                    to_delete_keys.discard(key)
-
-                    if key in routes:
-                        routes[key].endpoint = create_endpoint(endpoint)
-                    else:
-                        app.router.routes.insert(0, Route(
-                            name=key,
-                            path=f'/_c/{key}',
-                            endpoint=create_endpoint(endpoint),
-                            methods=['POST']))
-
-                # Rebuild src
-                src = build_client_source(loaded_module.__name__, change_path)
-
-                # Notify all clients
-                for queue in change_queues.values():
-                    queue.put_nowait((change_type, change_path, src))
-
-                # Delete old routes
-                app.router.routes = [r for r in app.routes if r.name not in to_delete_keys]
-
-
-    async def client_reloader(ws: WebSocket):
+    def reload_changes(self, changes: set[tuple[Change, str]]) -> Optional[ReloadResult]:
+        start = time.perf_counter()
+
+        # Full pipeline is only run if config changes, otherwise only changed modules are patched
+        if any(Path(change_path).name == 'pyproject.toml' for _, change_path in changes):
+            new_packages = get_config()['npm_packages']
+            build_runtime(self.target_dir, options={
+                'reload': True,
+                'build_import_modules': self.current_packages != new_packages,
+            })
+            if self.current_packages != new_packages:
+                # TODO: full reload page
+                print('Packages changed, full reload')
+                self.current_packages = new_packages
+
+        # Module name -> (change type, path) of changed modules that are loaded
+        changed = {}
+        for change_type, change_path in changes:
+            change_path = Path(change_path)
+            if change_path.suffix != '.py':
+                continue
+            loaded_module = self.module_index.get(change_path)
+            if loaded_module:
+                changed[loaded_module.__name__] = (change_type, change_path)
+        if not changed:
+            return None
+
+        # Dependents are reloaded after the modules they import, so they don't keep stale references
+        self.update_graph(changed)
+        reload_order = self.graph.get_reload_order(changed)
+        reloaded = []
+        endpoints = EndpointChanges()
+        for module_name in reload_order:
+            module = sys.modules.get(module_name)
+            if module is None or not getattr(module, '__file__', None):
+                continue
+            change_type, module_path = changed.get(module_name, (Change.modified, Path(module.__file__).absolute()))
+            if reload_module(module, module_path, change_type, endpoints) and change_type != Change.deleted:
+                reloaded.append(module_name)
+        for module_name, (change_type, _) in changed.items():
+            if change_type == Change.deleted:
+                self.graph.remove(module_name)
+        return ReloadResult(changed, reload_order, reloaded, endpoints, start)
+
+    def build_batch(self, result: ReloadResult) -> ReloadBatch:
+        changed, reload_order, reloaded, _, start = result
+
+        # Modules added to or removed from the bundle need a full rebuild
+        is_module_deleted = any(change_type == Change.deleted for change_type, _ in changed.values())
+        if is_module_deleted or is_bundle_changed(self.target_dir):
+            build_runtime(self.target_dir, options={
+                'reload': True,
+                'build_import_modules': False,
+            })
+
+        batch = ReloadBatch()
+        archives = get_bundle_archives(self.target_dir)
+        cwd = Path('.').absolute()
+        for module_name, (change_type, change_path) in changed.items():
+            if change_type == Change.deleted:
+                continue
+            src = patch_bundle(self.target_dir, module_name, change_path)
+            if src is not None:
+                batch.add_file(
+                    change_type,
+                    str(change_path.relative_to(self.root_path)),
+                    archives[str(change_path.absolute().relative_to(cwd))],
+                    src,
+                    self.sources.get(change_path),
+                )
+                self.sources[change_path] = src
+
+        # Modules outside the bundle are not loaded by clients
+        for module_name in reload_order:
+            module_file = getattr(sys.modules.get(module_name), '__file__', None)
+            if not module_file:
+                continue
+            module_path = Path(module_file).absolute()
+            archive = module_path.is_relative_to(cwd) and archives.get(str(module_path.relative_to(cwd)))
+            if archive:
+                batch.reload_order.append((module_name, archive))
+
+        # Changes are reported once watchfiles settles, so also measure from file modification
+        saved_at = max(
+            (p.stat().st_mtime for change_type, p in changed.values() if change_type != Change.deleted),
+            default=time.time(),
+        )
+        print(
+            f'Updated {", ".join(reloaded)} in {time.perf_counter() - start:.3f}s, '
+            f'{time.time() - saved_at:.3f}s after save'
+        )
+        return batch
+
+    def update_graph(self, changed: dict[str, tuple[Change, Path]]):
+        # Parse modules imported since last update, and changed modules
+        added, self.graph_offset = self.module_index.added_since(self.graph_offset)
+        paths = {name: path for path, name in added}
+        paths.update((name, path) for name, (_, path) in changed.items())
+        for module_name, path in paths.items():
+            if path.suffix != '.py' or not is_project_module(path, self.root_path):
+                continue
+            try:
+                src = path.read_text()
+            except OSError:
+                self.graph.remove(module_name)
+                continue
+            self.graph.update(module_name, src, path.name == '__init__.py')
+
+    async def client_reloader(self, ws: WebSocket):
+        client = ReloaderClient()
         try:
             await ws.accept()
-            change_queues[ws] = Queue()
-            while True:
-                change_type, change_path, src = await change_queues[ws].get()
-                change_path = Path(change_path)
-                change_path = change_path.relative_to(root_path.absolute())
-                await ws.send_json({
-                    'c': change_type,
-                    'p': str(change_path),
-                    's': src,
-                })
-        except websockets.exceptions.ConnectionClosed:
+            self.resume_client(ws, client, await ws.receive_json())
+            sender = asyncio.create_task(self.send_messages(ws, client))
+            try:
+                while True:
+                    self.add_client_chunks(client, await ws.receive_json())
+            finally:
+                sender.cancel()
+        except (websockets.exceptions.ConnectionClosed, WebSocketDisconnect):
             pass
         finally:
-            del change_queues[ws]
+            self.clients.pop(ws, None)
             await ws.close()
 
-    app.add_websocket_route('/_dev/reloader', client_reloader)
-    Thread(target=watch_thread, daemon=True).start()
+    async def send_messages(self, ws: WebSocket, client: ReloaderClient):
+        while True:
+            await ws.send_text(await client.queue.get())
+
+    def get_batches_since(self, sequence) -> Optional[list[ReloadBatch]]:
+        # None if batches after sequence are no longer kept
+        if not isinstance(sequence, int) or not self.sequence - len(self.log) <= sequence <= self.sequence:
+            return None
+        return [batch for batch in self.log if batch.sequence > sequence]
+
+    def resume_client(self, ws: WebSocket, client: ReloaderClient, data: dict):
+        # Client sends the server instance and sequence it last applied, and route chunks it loaded
+        client.archives = frozenset({'dist.zip', *(f'chunks/{c}.zip' for c in data.get('c', []))})
+        if data.get('i') is None:
+            client.queue.put_nowait(json.dumps({'i': self.instance_id, 'n': self.sequence}))
+            self.clients[ws] = client
+            return
+
+        batches = self.get_batches_since(data.get('n'))
+        if data['i'] != self.instance_id or batches is None:
+            # Client can't catch up, so reloads the page
+            client.queue.put_nowait(json.dumps({'i': self.instance_id, 'x': True}))
+            return
+
+        client.queue.put_nowait(json.dumps({'i': self.instance_id}))
+        for batch in batches:
+            client.queue.put_nowait(batch.get_message(client.archives))
+        self.clients[ws] = client
+
+    def add_client_chunks(self, client: ReloaderClient, data: dict):
+        # Chunks are reported after loading, with the sequence before they were fetched
+        new_archives = frozenset(f'chunks/{c}.zip' for c in data.get('c', [])) - client.archives
+        client.archives |= new_archives
+        batches = self.get_batches_since(data.get('n'))
+        if batches is None:
+            return
+        for batch in batches:
+            message = batch.serialize(new_archives, is_replay=True)
+            if message is not None:
+                client.queue.put_nowait(message)
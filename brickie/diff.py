@@ -0,0 +1,27 @@
+import zlib
+
+from difflib import SequenceMatcher
+
+
+def get_source_hash(src: str) -> int:
+    return zlib.crc32(src.encode())
+
+
+def diff_source(old_src: str, new_src: str) -> list[list]:
+    # Line ranges of old source and their replacement text, as [start, end, text]
+    old_lines = old_src.splitlines(keepends=True)
+    new_lines = new_src.splitlines(keepends=True)
+    return [
+        [i1, i2, ''.join(new_lines[j1:j2])]
+        for tag, i1, i2, j1, j2 in SequenceMatcher(None, old_lines, new_lines, autojunk=False).get_opcodes()
+        if tag != 'equal'
+    ]
+
+
+def apply_source_diff(src: str, ops: list[list]) -> str:
+    lines = src.splitlines(keepends=True)
+
+    # Applied from the end, so earlier line numbers stay valid
+    for start, end, text in reversed(ops):
+        lines[start:end] = [text]
+    return ''.join(lines)
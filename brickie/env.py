@@ -5,6 +5,12 @@ from contextlib import contextmanager
 IS_CLIENT = '_pyodide_core' in sys.modules
 IS_RELOAD_ENABLED = False
 
+# Client transport for server calls, either `http`, `batch` or `websocket`
+RPC_TRANSPORT = 'batch'
+
+# Encoding for server calls, either `json` or `binary`
+RPC_ENCODING = 'json'
+
 _is_reload_context = False
 _is_init_context = False
 
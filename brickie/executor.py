@@ -0,0 +1,297 @@
+from __future__ import annotations
+
+import asyncio
+import importlib
+import inspect
+import multiprocessing
+import os
+import threading
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Optional
+
+_options = {
+    'thread_pool_size': None,
+    'process_pool_size': None,
+    'process_timeout': None,
+    'process_max_tasks': None,
+}
+
+
+def _import_modules(module_names: list[str]):
+    for module_name in module_names:
+        importlib.import_module(module_name)
+
+
+def _call_in_process(module_name: str, qualname: str, args, kwargs):
+    # Resolve server function by name, as the function itself can't be pickled across processes
+    f = importlib.import_module(module_name)
+    for name in qualname.split('.'):
+        f = getattr(f, name)
+
+    result = f(*args, **kwargs)
+    if inspect.iscoroutine(result):
+        result = asyncio.run(result)
+    return result
+
+
+def _run_coroutine(f: Callable, args, kwargs):
+    # Async server function run on its own event loop in the worker, instead of on the server loop
+    return asyncio.run(f(*args, **kwargs))
+
+
+class ThreadPool:
+    def __init__(self, max_workers: Optional[int] = None) -> None:
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='brickie-server')
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+
+    def _dequeue(self, call: dict) -> bool:
+        # Call leaves the queue once, either when started or when cancelled before starting
+        with self.lock:
+            if call['dequeued']:
+                return False
+            call['dequeued'] = True
+            self.queued -= 1
+            return True
+
+    def _run(self, call: dict, f: Callable, args, kwargs):
+        if not self._dequeue(call):
+            return None
+        with self.lock:
+            self.running += 1
+        try:
+            return f(*args, **kwargs)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+    async def run(self, f: Callable, args, kwargs):
+        call = {'dequeued': False}
+        with self.lock:
+            self.queued += 1
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self.executor, partial(self._run, call, f, args, kwargs))
+        finally:
+            self._dequeue(call)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+    def get_stats(self) -> dict[str, int]:
+        return {
+            'max_workers': self.executor._max_workers,
+            'queued': self.queued,
+            'running': self.running,
+        }
+
+
+def _process_worker(conn, module_names: list[str]):
+    # Runs calls sent by the pool one at a time, until sent None or the pool closes the pipe
+    _import_modules(module_names)
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+        try:
+            result = (True, _call_in_process(*message))
+        except Exception as exc:
+            result = (False, exc)
+        try:
+            conn.send(result)
+        except Exception as exc:
+            # Result or exception can't be pickled
+            conn.send((False, RuntimeError(repr(exc))))
+
+
+class ProcessWorker:
+    def __init__(self, context, module_names: list[str]) -> None:
+        self.conn, worker_conn = context.Pipe()
+        self.process = context.Process(target=_process_worker, args=(worker_conn, module_names), daemon=True)
+        self.process.start()
+        worker_conn.close()
+        self.tasks = 0
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.conn.close()
+
+
+class ProcessPool:
+    # Each worker runs one call at a time, so a timed out call is stopped by killing only its worker
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        timeout: Optional[float] = None,
+        max_tasks: Optional[int] = None,
+    ) -> None:
+        from . import _endpoint_options, _endpoint_registry
+
+        # Import server function modules on worker start so calls don't pay for it
+        self.module_names = sorted({
+            _endpoint_registry[key].__module__
+            for key, options in _endpoint_options.items()
+            if options.get('executor') == 'process' and key in _endpoint_registry
+        })
+        self.context = multiprocessing.get_context()
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.max_tasks = max_tasks
+        self.workers: set[ProcessWorker] = set()
+        self.idle: list[ProcessWorker] = []
+        self.waiters: deque[asyncio.Future] = deque()
+        self.is_shutdown = False
+        self.pending = 0
+
+    def warm(self):
+        # Workers are started on demand, start them all ahead
+        while len(self.workers) < self.max_workers:
+            self._release(self._start_worker())
+
+    def _start_worker(self) -> ProcessWorker:
+        worker = ProcessWorker(self.context, self.module_names)
+        self.workers.add(worker)
+        return worker
+
+    def _discard_worker(self, worker: ProcessWorker, kill: bool = False):
+        self.workers.discard(worker)
+        worker.kill() if kill else worker.stop()
+
+        # Replace worker for calls still waiting, even once shut down
+        while self.waiters and self.waiters[0].done():
+            self.waiters.popleft()
+        if self.waiters:
+            self._release(self._start_worker())
+
+    def _release(self, worker: ProcessWorker):
+        if self.max_tasks and worker.tasks >= self.max_tasks:
+            return self._discard_worker(worker)
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(worker)
+                return
+        if self.is_shutdown:
+            self._discard_worker(worker)
+        else:
+            self.idle.append(worker)
+
+    async def _acquire(self) -> ProcessWorker:
+        if self.idle:
+            return self.idle.pop()
+        if len(self.workers) < self.max_workers:
+            return self._start_worker()
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            # Worker may have been handed over as the wait was cancelled
+            if waiter.done() and not waiter.cancelled():
+                self._release(waiter.result())
+            raise
+
+    async def run(self, f: Callable, args, kwargs):
+        self.pending += 1
+        try:
+            worker = await self._acquire()
+            try:
+                worker.conn.send((f.__module__, f.__qualname__, args, kwargs))
+
+                # Timeout starts once the call is sent to an idle worker, not while it is queued
+                loop = asyncio.get_running_loop()
+                is_ready = await loop.run_in_executor(None, worker.conn.poll, self.timeout)
+                if not is_ready:
+                    raise asyncio.TimeoutError()
+                is_ok, result = worker.conn.recv()
+            except EOFError:
+                self._discard_worker(worker, kill=True)
+                raise RuntimeError(f'Process worker exited running {f.__qualname__}') from None
+            except BaseException:
+                # Worker is still running the call, such as when timed out or cancelled
+                self._discard_worker(worker, kill=True)
+                raise
+
+            worker.tasks += 1
+            self._release(worker)
+            if not is_ok:
+                raise result
+            return result
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        # Running and waiting calls complete, workers are stopped once idle
+        self.is_shutdown = True
+        for worker in self.idle:
+            self._discard_worker(worker)
+        self.idle.clear()
+
+    def get_stats(self) -> dict[str, int]:
+        return {
+            'max_workers': self.max_workers,
+            'pending': self.pending,
+        }
+
+
+_thread_pool: Optional[ThreadPool] = None
+_process_pool: Optional[ProcessPool] = None
+
+
+def configure(**options):
+    global _thread_pool
+    _options.update(options)
+
+    # Pools are recreated with new options on next use
+    if _thread_pool is not None:
+        _thread_pool.shutdown()
+        _thread_pool = None
+    recycle_process_pool()
+
+
+def recycle_process_pool():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown()
+        _process_pool = None
+
+
+def get_thread_pool() -> ThreadPool:
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPool(_options['thread_pool_size'])
+    return _thread_pool
+
+
+def get_process_pool() -> ProcessPool:
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPool(
+            max_workers=_options['process_pool_size'],
+            timeout=_options['process_timeout'],
+            max_tasks=_options['process_max_tasks'])
+    return _process_pool
+
+
+def get_stats() -> dict[str, dict[str, int]]:
+    stats = {}
+    if _thread_pool is not None:
+        stats['thread_pool'] = _thread_pool.get_stats()
+    if _process_pool is not None:
+        stats['process_pool'] = _process_pool.get_stats()
+    return stats
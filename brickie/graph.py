@@ -0,0 +1,56 @@
+from collections import defaultdict
+
+from .bundle import get_module_imports
+
+
+class ModuleGraph:
+    # Import graph of project modules, each module is reparsed only when it changes
+
+    def __init__(self) -> None:
+        self.imports: dict[str, set[str]] = {}
+        self.importers: dict[str, set[str]] = defaultdict(set)
+
+    def __contains__(self, module_name: str) -> bool:
+        return module_name in self.imports
+
+    def update(self, module_name: str, src: str, is_package: bool = False):
+        self.remove(module_name)
+        try:
+            imports = get_module_imports(module_name, src, is_package) - {module_name}
+        except SyntaxError:
+            # Keep module in graph, its imports are found once it parses again
+            imports = set()
+        self.imports[module_name] = imports
+        for name in imports:
+            self.importers[name].add(module_name)
+
+    def remove(self, module_name: str):
+        for name in self.imports.pop(module_name, ()):
+            self.importers[name].discard(module_name)
+
+    def get_reload_order(self, module_names) -> list[str]:
+        # Changed modules and all modules importing them, each after the modules it imports
+        affected = set()
+        stack = list(module_names)
+        while stack:
+            name = stack.pop()
+            if name in affected:
+                continue
+            affected.add(name)
+            stack.extend(self.importers.get(name, ()))
+
+        pending = {name: self.imports.get(name, set()) & affected for name in affected}
+        ready = sorted(name for name, imports in pending.items() if not imports)
+        order = []
+        while ready:
+            name = ready.pop(0)
+            order.append(name)
+            for importer in sorted(self.importers.get(name, ())):
+                if importer in pending and name in pending[importer]:
+                    pending[importer].discard(name)
+                    if not pending[importer]:
+                        ready.append(importer)
+
+        # Modules in import cycles are reloaded last, in name order
+        order.extend(sorted(affected - set(order)))
+        return order
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+
+from pathlib import Path
+from typing import Optional
+
+MANIFEST_VERSION = 1
+# Outside the build directory, as it maps server functions to their keys
+MANIFEST_PATH = Path('.brickie/endpoints.json')
+
+# Module path -> manifest entry loaded from last build, `None` until loaded
+_manifest: Optional[dict[str, dict]] = None
+
+# Module path -> manifest entry for modules imported by this process
+_entries: dict[str, dict] = {}
+
+
+def _module_id(path: Path) -> str:
+    # Relative to project when possible, so build output can be moved with it
+    path = Path(path).absolute()
+    cwd = Path('.').absolute()
+    return str(path.relative_to(cwd)) if path.is_relative_to(cwd) else str(path)
+
+
+def _file_hash(path: Path) -> str:
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+def load(manifest_path: Path = MANIFEST_PATH) -> dict[str, dict]:
+    global _manifest
+    if _manifest is None:
+        try:
+            manifest = json.loads(Path(manifest_path).read_text())
+        except (OSError, ValueError):
+            manifest = {}
+        if manifest.get('version') != MANIFEST_VERSION:
+            manifest = {}
+        _manifest = manifest.get('modules', {})
+    return _manifest
+
+
+def _is_current(entry: dict, stat: os.stat_result) -> bool:
+    return entry['mtime'] == stat.st_mtime_ns and entry['size'] == stat.st_size
+
+
+def get_key(path: Path, module_name: str, qualname: str, recorded: bool = False) -> Optional[str]:
+    module_id = _module_id(path)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    # Keys computed by this process, only complete once the module has been fully imported
+    if recorded:
+        entry = _entries.get(module_id)
+        if entry is not None and entry['module'] == module_name and _is_current(entry, stat):
+            key = entry['keys'].get(qualname)
+            if key is not None:
+                return key
+
+    # Keys from last build
+    entry = load().get(module_id)
+    if entry is None or entry['module'] != module_name:
+        return None
+    if not _is_current(entry, stat):
+        # File touched but unchanged still has valid keys
+        if entry['hash'] != _file_hash(path):
+            entry['keys'] = {}
+        entry['mtime'] = stat.st_mtime_ns
+        entry['size'] = stat.st_size
+    return entry['keys'].get(qualname)
+
+
+def record(path: Path, module_name: str, qualname: str, key: str):
+    module_id = _module_id(path)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return
+    entry = _entries.get(module_id)
+    if entry is None or not _is_current(entry, stat):
+        # New module or module changed since recorded, e.g. reloaded
+        entry = _entries[module_id] = {
+            'module': module_name,
+            'mtime': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'keys': {},
+        }
+
+    # Ambiguous qualnames, e.g. conditionally defined functions, are always hashed
+    if entry['keys'].get(qualname, key) != key:
+        key = None
+    entry['keys'][qualname] = key
+
+
+def write(manifest_path: Path = MANIFEST_PATH):
+    modules = {}
+    for module_id, entry in _entries.items():
+        path = Path(module_id)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+
+        # Skip modules changed since their keys were computed
+        if not _is_current(entry, stat):
+            continue
+        modules[module_id] = {
+            **entry,
+            'hash': _file_hash(path),
+            'keys': {q: k for q, k in entry['keys'].items() if k is not None},
+        }
+
+    manifest_path = Path(manifest_path)
+    manifest_path.parent.mkdir(exist_ok=True, parents=True)
+    manifest_path.write_text(json.dumps({'version': MANIFEST_VERSION, 'modules': modules}))
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import sys
+import threading
+
+from importlib.abc import MetaPathFinder
+from pathlib import Path
+from types import ModuleType
+from typing import Optional
+
+_module_index: Optional[ModuleIndex] = None
+
+
+class _ImportRecorder(MetaPathFinder):
+    # Records names of imported modules and the importing thread, leaving the import to the other finders
+
+    def __init__(self, pending: list[tuple[str, int]]) -> None:
+        self.pending = pending
+
+    def find_spec(self, fullname, path, target=None):
+        self.pending.append((fullname, threading.get_ident()))
+        return None
+
+
+class ModuleIndex:
+    # Module file path -> loaded module, updated from an import hook instead of scanning sys.modules
+
+    def __init__(self) -> None:
+        self._names: dict[Path, str] = {}
+        self._added: list[tuple[Path, str]] = []
+        self._pending: list[tuple[str, int]] = []
+
+        # Thread ident -> name of last module found by the thread but not yet in `sys.modules`
+        self._unresolved: dict[int, str] = {}
+        sys.meta_path.insert(0, _ImportRecorder(self._pending))
+
+        # Modules imported before the hook was installed
+        self._pending.extend((name, threading.get_ident()) for name in list(sys.modules))
+
+    def _add(self, name: str) -> bool:
+        module = sys.modules.get(name)
+        if module is None:
+            return False
+
+        # Modules have their file set before they are added to `sys.modules`
+        module_file = getattr(module, '__file__', None)
+        if module_file:
+            path = Path(module_file).absolute()
+            if self._names.get(path) != name:
+                self._names[path] = name
+                self._added.append((path, name))
+        return True
+
+    def _flush(self):
+        # Modules are indexed on lookup, as they are not in `sys.modules` yet when found
+        count = len(self._pending)
+        if not count and not self._unresolved:
+            return
+        batch = self._pending[:count]
+        del self._pending[:count]
+
+        # A thread finds modules one at a time, so its previous module is either added by now or failed
+        for name, ident in batch:
+            previous = self._unresolved.pop(ident, None)
+            if previous is not None:
+                self._add(previous)
+            if not self._add(name):
+                self._unresolved[ident] = name
+
+        # Import by this thread or an exited thread has finished without a module,
+        # import by another thread may still be running and is kept until it completes
+        current = threading.get_ident()
+        idents = None
+        for ident, name in list(self._unresolved.items()):
+            if self._add(name) or ident == current:
+                del self._unresolved[ident]
+                continue
+            if idents is None:
+                idents = {thread.ident for thread in threading.enumerate()}
+            if ident not in idents:
+                del self._unresolved[ident]
+
+    def get(self, path: Path) -> Optional[ModuleType]:
+        self._flush()
+        path = Path(path).absolute()
+        module = sys.modules.get(self._names.get(path))
+        if module is None or getattr(module, '__file__', None) is None:
+            return None
+
+        # Module may have been removed from, or replaced in `sys.modules`
+        if Path(module.__file__).absolute() != path:
+            return None
+        return module
+
+    def added_since(self, offset: int) -> tuple[list[tuple[Path, str]], int]:
+        # Modules indexed since offset returned by last call, and offset to use next
+        self._flush()
+        return self._added[offset:], len(self._added)
+
+
+def get_module_index() -> ModuleIndex:
+    global _module_index
+    if _module_index is None:
+        _module_index = ModuleIndex()
+    return _module_index
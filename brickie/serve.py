@@ -1,17 +1,268 @@
-from asyncio import Future
+import inspect
+import json
+import os
+import re
+import traceback
 
-from starlette.responses import FileResponse, JSONResponse
+from asyncio import Future, Task, create_task, gather, shield
+from copy import deepcopy
+from typing import Optional
 
+import anyio
 
-def create_endpoint(_f):
-    async def _e(request):
-        params = await request.json()
-        result = await _f(*params['a'], **params['k'])
-        if isinstance(result, Future):
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from starlette.staticfiles import StaticFiles
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+from . import _endpoint_options, _endpoint_registry, executor, wire
+from .bundle import PRECOMPRESS_ENCODINGS, is_hashed_asset
+from .cache import MISSING, ResultCache, _endpoint_caches
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# (endpoint key, normalized params) -> running call shared by identical concurrent calls
+_inflight_calls: dict[tuple[str, str], Task] = {}
+
+
+async def run_endpoint(key, _f, params):
+    options = _endpoint_options.get(key, {})
+    if options.get('executor') == 'process':
+        return await executor.get_process_pool().run(_f, params['a'], params['k'])
+    if options.get('executor') == 'thread' and inspect.iscoroutinefunction(_f):
+        return await executor.get_thread_pool().run(executor._run_coroutine, (_f, params['a'], params['k']), {})
+    if not inspect.iscoroutinefunction(_f):
+        # Run blocking server functions outside of the event loop, sync wrappers may still return awaitables
+        result = await executor.get_thread_pool().run(_f, params['a'], params['k'])
+        if inspect.isawaitable(result):
             result = await result
-        return JSONResponse({'r': result})
-    return _e
+        return result
+
+    result = await _f(*params['a'], **params['k'])
+    if isinstance(result, Future):
+        result = await result
+    return result
+
+
+async def run_single_flight(key, _f, params):
+    flight_key = (key, ResultCache.make_key(params))
+    task = _inflight_calls.get(flight_key)
+    if task is None:
+        task = create_task(run_endpoint(key, _f, params))
+        _inflight_calls[flight_key] = task
+        task.add_done_callback(lambda _: _inflight_calls.pop(flight_key, None))
+
+    # Shield shared call from cancellation of any single caller
+    result = await shield(task)
+    return deepcopy(result)
+
+
+async def call_endpoint(key, _f, params):
+    cache = _endpoint_caches.get(key)
+    if cache is not None:
+        cache_key = cache.make_key(params)
+        result = cache.get(cache_key)
+        if result is not MISSING:
+            return result
+
+    options = _endpoint_options.get(key, {})
+    if options.get('single_flight'):
+        result = await run_single_flight(key, _f, params)
+    else:
+        result = await run_endpoint(key, _f, params)
+
+    if cache is not None:
+        cache.set(cache_key, result)
+    return result
+
+
+async def stream_endpoint(_f, params):
+    try:
+        async for item in _f(*params['a'], **params['k']):
+            yield json.dumps({'r': item}) + '\n'
+    except Exception:
+        traceback.print_exc()
+        yield json.dumps({'e': 'Internal Server Error'}) + '\n'
+
+
+async def read_params(request) -> dict:
+    if request.headers.get('content-type') == wire.CONTENT_TYPE:
+        return wire.loads(await request.body())
+    return await request.json()
+
+
+def create_response(request, content: dict) -> Response:
+    # Binary encoding is used if accepted by client, otherwise JSON
+    if wire.CONTENT_TYPE in request.headers.get('accept', ''):
+        return Response(wire.dumps(content), media_type=wire.CONTENT_TYPE)
+    return JSONResponse(content)
+
+
+async def endpoint(request):
+    # Single route for all server functions, dispatched by key lookup
+    key = request.path_params['key']
+    _f = _endpoint_registry.get(key)
+    if _f is None:
+        raise HTTPException(status_code=404)
+
+    params = await read_params(request)
+    if inspect.isasyncgenfunction(_f):
+        # Stream each item as a NDJSON line, generator is closed if client disconnects
+        return StreamingResponse(stream_endpoint(_f, params), media_type='application/x-ndjson')
+
+    result = await call_endpoint(key, _f, params)
+    return create_response(request, {'r': result})
+
+
+async def call_keyed_endpoint(params) -> dict:
+    endpoint = _endpoint_registry.get(params['e'])
+    if endpoint is None:
+        return {'e': 'Not Found'}
+    try:
+        return {'r': await call_endpoint(params['e'], endpoint, params)}
+    except Exception:
+        # Errors are reported per call so other calls sharing the request still succeed
+        traceback.print_exc()
+        return {'e': 'Internal Server Error'}
+
+
+async def batch_endpoint(request):
+    params = await read_params(request)
+    results = await gather(*(call_keyed_endpoint(p) for p in params['c']))
+    return create_response(request, {'r': results})
+
+
+async def websocket_endpoint(ws: WebSocket):
+    tasks = set()
+
+    async def _call(params, is_binary):
+        result = {'i': params['i'], **await call_keyed_endpoint(params)}
+        if is_binary:
+            await ws.send_bytes(wire.dumps(result))
+        else:
+            await ws.send_json(result)
+
+    await ws.accept()
+    try:
+        while True:
+            message = await ws.receive()
+            if message['type'] == 'websocket.disconnect':
+                raise WebSocketDisconnect(message.get('code', 1000))
+
+            # Binary frames use binary encoding, responses are sent in the same encoding
+            is_binary = message.get('bytes') is not None
+            params = wire.loads(message['bytes']) if is_binary else json.loads(message['text'])
+
+            # Calls are run concurrently, responses are sent back as they complete
+            task = create_task(_call(params, is_binary))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
 
 
 def index(request):
-    return FileResponse('.brickie/build/index.html')
+    # Index is revalidated on every load, as it references the current hashed assets
+    path = '.brickie/build/index.html'
+    stat_result = os.stat(path)
+    headers = {'cache-control': 'no-cache', 'vary': 'Accept-Encoding'}
+    response = FileResponse(path, stat_result=stat_result, headers=headers)
+    sibling = get_precompressed_sibling(path, stat_result, request.headers.get('accept-encoding', ''))
+    if sibling is not None:
+        sibling_path, sibling_stat, encoding = sibling
+        content_type = response.headers['content-type']
+        response = FileResponse(sibling_path, stat_result=sibling_stat, headers={
+            **headers,
+            'content-encoding': encoding,
+            'content-type': content_type,
+        })
+
+    if_none_match = request.headers.get('if-none-match', '')
+    if response.headers['etag'] in [tag.strip(' W/') for tag in if_none_match.split(',')]:
+        return Response(status_code=304, headers={'etag': response.headers['etag'], **headers})
+    return response
+
+
+def get_index_routes() -> list[Route]:
+    from .client.router import _route_tree
+
+    # Client routes are served the index, `:param` segments are Starlette `{param}` segments
+    paths = {'/' + re.sub(r':(\w+)', r'{\1}', p).lstrip('/') for p in _route_tree.paths} | {'/'}
+    return [Route(p, index) for p in sorted(paths)]
+
+
+def get_accepted_encodings(accept_encoding: str) -> set[str]:
+    encodings = set()
+    for item in accept_encoding.split(','):
+        encoding, *params = item.split(';')
+        q = 1.0
+        for param in params:
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if encoding.strip() and q > 0:
+            encodings.add(encoding.strip().lower())
+    return encodings
+
+
+def get_precompressed_sibling(
+    path: str, stat_result: os.stat_result, accept_encoding: str,
+) -> Optional[tuple[str, os.stat_result, str]]:
+    # Path, stat and content encoding of the first precompressed sibling accepted by the client
+    accepted = get_accepted_encodings(accept_encoding)
+    for suffix, encoding in PRECOMPRESS_ENCODINGS.items():
+        if encoding not in accepted and '*' not in accepted:
+            continue
+        sibling_path = path + suffix
+        try:
+            sibling_stat = os.stat(sibling_path)
+        except OSError:
+            continue
+
+        # Siblings are only current if written for this version of the asset
+        if sibling_stat.st_mtime_ns != stat_result.st_mtime_ns:
+            continue
+        return sibling_path, sibling_stat, encoding
+    return None
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    # Serves .br and .gz siblings written at build time to clients accepting them,
+    # content hashed assets are served with long lived cache headers
+
+    async def get_response(self, path: str, scope) -> Response:
+        response = await self.get_encoded_response(path, scope)
+        if response.status_code in (200, 304):
+            # Other assets can change in place, such as when patched by dev reloads
+            if is_hashed_asset(path.replace(os.sep, '/')):
+                response.headers['cache-control'] = IMMUTABLE_CACHE_CONTROL
+            else:
+                response.headers['cache-control'] = 'no-cache'
+        return response
+
+    async def get_encoded_response(self, path: str, scope) -> Response:
+        response = await super().get_response(path, scope)
+        if not isinstance(response, FileResponse) or response.status_code != 200:
+            return response
+
+        response.headers['vary'] = 'Accept-Encoding'
+        accept_encoding = Headers(scope=scope).get('accept-encoding', '')
+        sibling = await anyio.to_thread.run_sync(
+            get_precompressed_sibling, response.path, response.stat_result, accept_encoding
+        )
+        if sibling is not None:
+            sibling_path, stat_result, encoding = sibling
+            compressed = self.file_response(sibling_path, stat_result, scope)
+            compressed.headers['content-encoding'] = encoding
+            compressed.headers['content-type'] = response.headers['content-type']
+            compressed.headers['vary'] = 'Accept-Encoding'
+            return compressed
+        return response
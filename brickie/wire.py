@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import struct
+import sys
+
+from array import array
+from typing import Any
+
+CONTENT_TYPE = 'application/x-brickie'
+
+T_NONE = 0x00
+T_FALSE = 0x01
+T_TRUE = 0x02
+T_INT = 0x03
+T_FLOAT = 0x04
+T_STR = 0x05
+T_BYTES = 0x06
+T_LIST = 0x07
+T_DICT = 0x08
+T_FLOAT_ARRAY = 0x09
+T_INT_ARRAY = 0x0a
+
+# Smallest signed array type code for range of values
+INT_TYPECODES = (
+    ('b', -2 ** 7, 2 ** 7 - 1),
+    ('h', -2 ** 15, 2 ** 15 - 1),
+    ('i', -2 ** 31, 2 ** 31 - 1),
+    ('q', -2 ** 63, 2 ** 63 - 1),
+)
+
+_pack_float = struct.Struct('<d').pack
+_unpack_float = struct.Struct('<d').unpack_from
+_is_little_endian = sys.byteorder == 'little'
+
+
+def _write_uint(out: bytearray, n: int):
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _read_uint(data: memoryview, pos: int) -> tuple[int, int]:
+    n = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def _write_array(out: bytearray, tag: int, typecode: str, value: list):
+    arr = array(typecode, value)
+    if not _is_little_endian:
+        arr.byteswap()
+    out.append(tag)
+    if tag == T_INT_ARRAY:
+        out += typecode.encode('ascii')
+    _write_uint(out, len(arr))
+    out += arr.tobytes()
+
+
+def _encode(out: bytearray, value: Any):
+    t = type(value)
+    if value is None:
+        out.append(T_NONE)
+    elif t is bool:
+        out.append(T_TRUE if value else T_FALSE)
+    elif t is int:
+        # Zigzag so small negative numbers stay short
+        out.append(T_INT)
+        _write_uint(out, (value << 1) if value >= 0 else ((-value << 1) - 1))
+    elif t is float:
+        out.append(T_FLOAT)
+        out += _pack_float(value)
+    elif t is str:
+        encoded = value.encode('utf-8')
+        out.append(T_STR)
+        _write_uint(out, len(encoded))
+        out += encoded
+    elif t in (bytes, bytearray, memoryview):
+        out.append(T_BYTES)
+        _write_uint(out, len(value))
+        out += value
+    elif t in (list, tuple):
+        # Fast path for homogeneous numeric lists, copied as raw little endian memory
+        if len(value) > 1:
+            first = type(value[0])
+            if first is float and all(type(v) is float for v in value):
+                return _write_array(out, T_FLOAT_ARRAY, 'd', value)
+            if first is int and all(type(v) is int for v in value):
+                lo, hi = min(value), max(value)
+                for typecode, type_min, type_max in INT_TYPECODES:
+                    if type_min <= lo and hi <= type_max:
+                        return _write_array(out, T_INT_ARRAY, typecode, value)
+        out.append(T_LIST)
+        _write_uint(out, len(value))
+        for v in value:
+            _encode(out, v)
+    elif t is dict:
+        out.append(T_DICT)
+        _write_uint(out, len(value))
+        for k, v in value.items():
+            _encode(out, k)
+            _encode(out, v)
+    else:
+        raise TypeError(f'Object of type {t.__name__} is not serializable')
+
+
+def _read_array(data: memoryview, pos: int, typecode: str) -> tuple[list, int]:
+    n, pos = _read_uint(data, pos)
+    arr = array(typecode)
+    end = pos + n * arr.itemsize
+    arr.frombytes(data[pos:end])
+    if not _is_little_endian:
+        arr.byteswap()
+    return arr.tolist(), end
+
+
+def _decode(data: memoryview, pos: int) -> tuple[Any, int]:
+    tag = data[pos]
+    pos += 1
+    if tag == T_NONE:
+        return None, pos
+    elif tag == T_FALSE:
+        return False, pos
+    elif tag == T_TRUE:
+        return True, pos
+    elif tag == T_INT:
+        n, pos = _read_uint(data, pos)
+        return (n >> 1) if not n & 1 else -((n + 1) >> 1), pos
+    elif tag == T_FLOAT:
+        return _unpack_float(data, pos)[0], pos + 8
+    elif tag == T_STR:
+        n, pos = _read_uint(data, pos)
+        return str(data[pos:pos + n], 'utf-8'), pos + n
+    elif tag == T_BYTES:
+        n, pos = _read_uint(data, pos)
+        return bytes(data[pos:pos + n]), pos + n
+    elif tag == T_LIST:
+        n, pos = _read_uint(data, pos)
+        out = []
+        for _ in range(n):
+            v, pos = _decode(data, pos)
+            out.append(v)
+        return out, pos
+    elif tag == T_DICT:
+        n, pos = _read_uint(data, pos)
+        out = {}
+        for _ in range(n):
+            k, pos = _decode(data, pos)
+            out[k], pos = _decode(data, pos)
+        return out, pos
+    elif tag == T_FLOAT_ARRAY:
+        return _read_array(data, pos, 'd')
+    elif tag == T_INT_ARRAY:
+        typecode = chr(data[pos])
+        if typecode not in 'bhiq':
+            raise ValueError(f'Unknown integer array type {typecode}')
+        return _read_array(data, pos + 1, typecode)
+    raise ValueError(f'Unknown type tag {tag}')
+
+
+def dumps(value: Any) -> bytes:
+    out = bytearray()
+    _encode(out, value)
+    return bytes(out)
+
+
+def loads(data: bytes) -> Any:
+    value, pos = _decode(memoryview(data), 0)
+    if pos != len(data):
+        raise ValueError('Unexpected trailing data')
+    return value
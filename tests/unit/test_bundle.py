@@ -0,0 +1,444 @@
+import json
+
+from pathlib import Path
+from zipfile import ZIP_DEFLATED, ZipFile
+
+from brickie.bundle import build_client_source, build_client_source_cached, write_zip
+
+
+def test_build_client_source_cached(tmp_path: Path):
+    module_path = tmp_path / 'module.py'
+    module_path.write_text('@server\nasync def f():\n    return 1\n')
+    cache_dir = tmp_path / 'cache'
+
+    src = build_client_source_cached('module', module_path, cache_dir)
+    assert src == build_client_source('module', module_path)
+    cached = list((cache_dir / 'transform' / 'module').glob('*.py'))
+    assert len(cached) == 1
+
+    # Cached output is reused
+    cached[0].write_text('cached')
+    assert build_client_source_cached('module', module_path, cache_dir) == 'cached'
+
+    # Changed source is transformed again, replacing stale entry
+    module_path.write_text('@server\nasync def f():\n    return 2\n')
+    src = build_client_source_cached('module', module_path, cache_dir)
+    assert src == build_client_source('module', module_path)
+    assert len(list((cache_dir / 'transform' / 'module').glob('*.py'))) == 1
+
+
+def test_write_zip(tmp_path: Path):
+    zip_path = tmp_path / 'dist.zip'
+    assert write_zip(zip_path, {'a.py': 'a', 'b.py': 'b'})
+    assert not write_zip(zip_path, {'b.py': 'b', 'a.py': 'a'})
+    assert write_zip(zip_path, {'a.py': 'a', 'b.py': 'c'})
+    assert write_zip(zip_path, {'a.py': 'a'})
+
+    with ZipFile(zip_path) as zf:
+        assert zf.namelist() == ['a.py']
+
+    # Changed compression rewrites unchanged entries
+    assert write_zip(zip_path, {'a.py': 'a'}, compress_level=9)
+    assert not write_zip(zip_path, {'a.py': 'a'}, compress_level=9)
+    with ZipFile(zip_path) as zf:
+        assert zf.infolist()[0].compress_type == ZIP_DEFLATED
+
+
+def test_build_import_modules_skips_unchanged(tmp_path: Path, monkeypatch):
+    import subprocess
+
+    from brickie import bundle
+
+    config = {'npm_packages': []}
+    runs = []
+
+    def run(args, cwd):
+        runs.append(args[0] if args[0] == 'npm' else args[1])
+        (Path(cwd) / ('node_modules' if args[0] == 'npm' else 'bundle')).mkdir(exist_ok=True)
+        return subprocess.CompletedProcess(args, 0)
+
+    monkeypatch.setattr(bundle, 'get_config', lambda: config)
+    monkeypatch.setattr(bundle.subprocess, 'run', run)
+    monkeypatch.setattr(bundle, 'BUILD_LOG_PATH', tmp_path / 'log' / 'build.log')
+
+    bundle.build_import_modules(tmp_path)
+    assert runs == ['npm', 'esbuild']
+
+    profile = bundle.BuildProfile()
+    bundle.build_import_modules(tmp_path, profile=profile)
+    assert runs == ['npm', 'esbuild']
+    assert profile.skipped_stages == ['npm_install', 'esbuild']
+
+    bundle.build_import_modules(tmp_path, force=True)
+    assert runs == ['npm', 'esbuild'] * 2
+
+    config['npm_packages'] = ['other: 1.0.0']
+    bundle.build_import_modules(tmp_path)
+    assert runs == ['npm', 'esbuild'] * 3
+
+    # Log isn't written to the served build directory
+    assert not (tmp_path / 'build.log').exists()
+    log = (tmp_path / 'log' / 'build.log').read_text()
+    assert 'npm install skipped' in log
+    assert 'esbuild skipped' in log
+
+
+def test_build_wheel_cached(tmp_path: Path, monkeypatch):
+    from brickie import bundle
+
+    project_path = tmp_path / 'project'
+    (project_path / '__pycache__').mkdir(parents=True)
+    (project_path / 'module.py').write_text('a = 1')
+    builds = []
+
+    class ProjectBuilder:
+        def __init__(self, path):
+            self.path = path
+
+        def build(self, distribution, output_directory):
+            builds.append(self.path)
+            Path(output_directory).mkdir(parents=True)
+            wheel_path = Path(output_directory) / 'project-0.1-py3-none-any.whl'
+            wheel_path.write_text((self.path / 'module.py').read_text())
+            return str(wheel_path)
+
+    monkeypatch.setattr(bundle.build, 'ProjectBuilder', ProjectBuilder)
+    target_dir = tmp_path / 'deps'
+    target_dir.mkdir()
+    cache_dir = tmp_path / 'cache'
+
+    wheel_path = bundle.build_wheel_cached(project_path, target_dir, cache_dir)
+    assert wheel_path == target_dir / 'project-0.1-py3-none-any.whl'
+    mtime = wheel_path.stat().st_mtime_ns
+
+    # Ignored directories don't invalidate cache, wheel in target is untouched
+    (project_path / '__pycache__' / 'module.pyc').write_text('')
+    assert bundle.build_wheel_cached(project_path, target_dir, cache_dir) == wheel_path
+    assert wheel_path.stat().st_mtime_ns == mtime
+    assert len(builds) == 1
+
+    (project_path / 'module.py').write_text('a = 22')
+    assert bundle.build_wheel_cached(project_path, target_dir, cache_dir) == wheel_path
+    assert wheel_path.read_text() == 'a = 22'
+    assert len(builds) == 2
+    project_cache_dir, = (cache_dir / 'wheels').glob('project-*')
+    assert len(list(project_cache_dir.iterdir())) == 1
+
+    # Projects with the same directory name are cached separately
+    other_path = tmp_path / 'vendor' / 'project'
+    other_path.mkdir(parents=True)
+    (other_path / 'module.py').write_text('a = 3')
+    other_target_dir = tmp_path / 'other_deps'
+    other_target_dir.mkdir()
+    bundle.build_wheel_cached(other_path, other_target_dir, cache_dir)
+    bundle.build_wheel_cached(project_path, target_dir, cache_dir)
+    bundle.build_wheel_cached(other_path, other_target_dir, cache_dir)
+    assert len(builds) == 3
+
+
+def test_transform_modules(tmp_path: Path, monkeypatch):
+    from brickie import bundle
+
+    monkeypatch.setattr(bundle, 'PARALLEL_TRANSFORM_MIN_MODULES', 2)
+    modules = {}
+    for i in range(4):
+        modules[f'module_{i}'] = tmp_path / f'module_{i}.py'
+        modules[f'module_{i}'].write_text(f'@server\nasync def f():\n    return {i}\n')
+
+    cache_dir = tmp_path / 'cache'
+    transformed = bundle.transform_modules(modules, cache_dir, max_workers=2)
+    assert list(transformed) == list(modules)
+    for module_name, (src, t) in transformed.items():
+        assert src == build_client_source(module_name, modules[module_name])
+        assert t >= 0
+
+    # Cached modules are read without transforming
+    monkeypatch.setattr(bundle, 'build_client_source', None)
+    cached = bundle.transform_modules(modules, cache_dir)
+    assert {m: src for m, (src, _) in cached.items()} == {m: src for m, (src, _) in transformed.items()}
+
+
+def test_build_bytecode_entries(tmp_path: Path, monkeypatch):
+    import importlib
+    import sys
+
+    import pytest
+
+    from brickie import bundle
+
+    cache_dir = tmp_path / 'cache'
+    python_version = sys.version_info[:2]
+    other_version = (3, 10) if python_version != (3, 10) else (3, 11)
+    entries = {'pkg_a/module_a.py': 'value = "a"', 'pkg_b/module_b.py': 'value = "b"'}
+
+    with pytest.raises(RuntimeError, match='Bytecode build requires'):
+        bundle.build_bytecode_entries(entries, 'only', other_version)
+    assert bundle.build_bytecode_entries(entries, 'off', other_version) == entries
+
+    only = bundle.build_bytecode_entries(
+        {'pkg_a/module_a.py': entries['pkg_a/module_a.py']}, 'only', python_version, cache_dir
+    )
+    alongside = bundle.build_bytecode_entries(
+        {'pkg_b/module_b.py': entries['pkg_b/module_b.py']}, 'alongside', python_version, cache_dir
+    )
+    assert (cache_dir / 'bytecode' / 'pkg_a/module_a.py').is_dir()
+    assert list(only) == ['pkg_a/module_a.pyc']
+    cache_tag = f'cpython-{python_version[0]}{python_version[1]}'
+    assert set(alongside) == {'pkg_b/module_b.py', f'pkg_b/__pycache__/module_b.{cache_tag}.pyc'}
+
+    for name, data in {**only, **alongside}.items():
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_bytes(data if isinstance(data, bytes) else data.encode('utf-8'))
+
+    monkeypatch.syspath_prepend(str(tmp_path))
+    assert importlib.import_module('pkg_a.module_a').value == 'a'
+    module_b = importlib.import_module('pkg_b.module_b')
+    assert module_b.value == 'b'
+
+    # Bytecode alongside source isn't used once reload rewrites the source
+    (tmp_path / 'pkg_b/module_b.py').write_text('value = "changed"')
+    assert importlib.reload(module_b).value == 'changed'
+
+
+def test_get_module_imports():
+    from brickie.bundle import get_module_imports
+
+    src = '\n'.join([
+        'import app.utils.text',
+        'from . import header',
+        'from .pages import home',
+        'from ..shared import Button',
+        'def f():',
+        '    from app.pages.about import About',
+    ])
+    imports = get_module_imports('app.client.index', src)
+    assert {
+        'app', 'app.utils', 'app.utils.text', 'app.client', 'app.client.header',
+        'app.client.pages', 'app.client.pages.home', 'app.shared', 'app.shared.Button',
+        'app.pages.about', 'app.pages.about.About',
+    } <= imports
+
+    # Relative imports of packages resolve from the package itself
+    assert 'app.client.pages' in get_module_imports('app.client', 'from . import pages', is_package=True)
+
+
+def test_split_bundle():
+    from brickie.bundle import split_bundle
+
+    module_imports = {
+        'index': {'shared'},
+        'shared': set(),
+        'home': {'shared', 'home_widget'},
+        'home_widget': set(),
+        'about': {'about_widget', 'common_widget'},
+        'about_widget': set(),
+        'blog': {'common_widget'},
+        'common_widget': {'common_util'},
+        'common_util': set(),
+        'orphan': set(),
+    }
+    core, chunks = split_bundle(module_imports, 'index', {'home', 'about', 'blog'})
+    assert core == {'index', 'shared', 'common_widget', 'common_util', 'orphan'}
+    assert chunks == {
+        'home': {'home', 'home_widget'},
+        'about': {'about', 'about_widget'},
+        'blog': {'blog'},
+    }
+
+    # Lazy modules imported by core are not split
+    module_imports['index'] = {'shared', 'home'}
+    core, chunks = split_bundle(module_imports, 'index', {'home', 'about', 'blog'})
+    assert {'home', 'home_widget'} <= core
+    assert set(chunks) == {'about', 'blog'}
+
+
+def test_build_compressed_assets(tmp_path: Path):
+    import gzip
+    import os
+
+    import brotli
+
+    from brickie.bundle import build_compressed_assets
+
+    asset_path = tmp_path / 'bundle' / 'imports.js'
+    asset_path.parent.mkdir()
+    asset_path.write_text('console.log("brickie");\n' * 100)
+    (tmp_path / 'small.js').write_text('small')
+    (tmp_path / 'deps.whl').write_bytes(b'0' * 2048)
+
+    build_compressed_assets(tmp_path)
+    gz_path = tmp_path / 'bundle' / 'imports.js.gz'
+    br_path = tmp_path / 'bundle' / 'imports.js.br'
+    assert gzip.decompress(gz_path.read_bytes()) == asset_path.read_bytes()
+    assert brotli.decompress(br_path.read_bytes()) == asset_path.read_bytes()
+    assert gz_path.stat().st_mtime_ns == asset_path.stat().st_mtime_ns
+    assert not (tmp_path / 'small.js.gz').exists()
+    assert not (tmp_path / 'deps.whl.gz').exists()
+
+    # Siblings of unchanged assets are kept
+    gz_path.write_bytes(b'kept')
+    os.utime(gz_path, ns=(asset_path.stat().st_atime_ns, asset_path.stat().st_mtime_ns))
+    build_compressed_assets(tmp_path)
+    assert gz_path.read_bytes() == b'kept'
+
+    # Siblings of removed assets are deleted
+    asset_path.unlink()
+    build_compressed_assets(tmp_path)
+    assert not gz_path.exists() and not br_path.exists()
+
+
+def test_build_hashed_assets(tmp_path: Path):
+    from brickie.bundle import build_hashed_assets, get_hashed_asset_name, is_hashed_asset
+
+    assert get_hashed_asset_name('bundle/imports.js', '0' * 16) == f'bundle/imports.{"0" * 16}.js'
+    assert get_hashed_asset_name('deps/a-1.0-py3-none-any.whl', '0' * 16) == f'deps/{"0" * 16}/a-1.0-py3-none-any.whl'
+    assert is_hashed_asset(get_hashed_asset_name('bundle/imports.js', '0' * 16))
+    assert is_hashed_asset(get_hashed_asset_name('deps/a-1.0-py3-none-any.whl', '0' * 16))
+    assert not is_hashed_asset('bundle/imports.js')
+
+    (tmp_path / 'dist.zip').write_bytes(b'1')
+    first = build_hashed_assets(tmp_path, ['dist.zip', 'missing.js'])
+    assert list(first) == ['dist.zip']
+    assert (tmp_path / first['dist.zip']).read_bytes() == b'1'
+    assert json.loads((tmp_path / 'assets.json').read_text()) == first
+
+    # Unchanged content keeps its name
+    assert build_hashed_assets(tmp_path, ['dist.zip']) == first
+
+    # Previous build assets are kept for one more build
+    (tmp_path / 'dist.zip').write_bytes(b'2')
+    second = build_hashed_assets(tmp_path, ['dist.zip'])
+    assert second != first
+    assert (tmp_path / first['dist.zip']).exists()
+
+    (tmp_path / 'dist.zip').write_bytes(b'3')
+    third = build_hashed_assets(tmp_path, ['dist.zip'])
+    assert not (tmp_path / first['dist.zip']).exists()
+    assert (tmp_path / second['dist.zip']).exists()
+    assert (tmp_path / third['dist.zip']).read_bytes() == b'3'
+
+
+def test_strip_server_only_names(tmp_path: Path, capsys, monkeypatch):
+    from brickie import bundle
+    from brickie.bundle import get_module_imports, get_stripped_names, print_strip_report, transform_client_source
+
+    module_path = tmp_path / 'module.py'
+    module_path.write_text('\n'.join([
+        'import json',
+        'import os.path',
+        'import pytest as pt',
+        'from tomli import loads, TOMLDecodeError',
+        'from . import db',
+        'TABLE = "items"',
+        'SHARED = "shared"',
+        '__all__ = ["EXPORTED"]',
+        'EXPORTED = "exported"',
+        'def query():',
+        '    return pt.approx(db.count(TABLE))',
+        'def render():',
+        '    return json.dumps([TOMLDecodeError, SHARED])',
+        'from app.router import route',
+        'CLIENT = connect()',
+        '@route("/")',
+        'def index():',
+        '    pass',
+        'class Model:',
+        '    pass',
+        '@server',
+        'async def load():',
+        '    return query(), loads(SHARED), os.path.join(EXPORTED), CLIENT, index, Model',
+    ]))
+    src, stripped = transform_client_source('app.module', module_path)
+    assert stripped == [
+        'import os.path', 'from tomli import loads', 'def query',
+        'import pytest as pt', 'from . import db', 'TABLE =',
+    ]
+    assert src == build_client_source('app.module', module_path)
+
+    # Names referenced by client code or exported are kept, as are statements with side effects
+    for name in (
+        'import json', 'TOMLDecodeError', 'SHARED =', 'EXPORTED =', 'def render',
+        'CLIENT = connect()', 'def index', 'class Model',
+    ):
+        assert name in src
+    for name in ('pytest', 'os.path', 'query', 'TABLE', 'import db', 'Stripped'):
+        assert name not in src
+
+    # Stripped names are kept with the cached transform, not in its output
+    cache_dir = tmp_path / 'cache'
+    assert build_client_source_cached('app.module', module_path, cache_dir) == src
+    assert get_stripped_names('app.module', module_path, cache_dir) == stripped
+
+    monkeypatch.setattr(bundle, 'BUILD_LOG_PATH', tmp_path / 'build.log')
+    print_strip_report({'app.module': stripped}, {'app.module': get_module_imports('app.module', src)})
+    out = capsys.readouterr().out
+    assert 'Stripped server only names from 1 modules' in out
+    assert '(pytest ' in out and 'tomli' not in out.split('\n')[0]
+    assert 'app.module: import os.path' in out
+
+
+def test_build_profile(tmp_path: Path):
+    from brickie.bundle import BuildProfile, write_zip
+
+    write_zip(tmp_path / 'dist.zip', {'app/a.py': 'a' * 1000, 'app/b.py': 'b'}, compress_level=9)
+    (tmp_path / 'esbuild-meta.json').write_text(json.dumps({
+        'outputs': {
+            'bundle/imports.js': {
+                'inputs': {
+                    'generated/imports.mjs': {'bytesInOutput': 10},
+                    'node_modules/react/index.js': {'bytesInOutput': 20},
+                    'node_modules/react/cjs/react.development.js': {'bytesInOutput': 30},
+                    'node_modules/@mui/material/index.js': {'bytesInOutput': 40},
+                    'node_modules/@mui/material/node_modules/clsx/index.js': {'bytesInOutput': 5},
+                },
+            },
+        },
+    }))
+
+    profile = BuildProfile()
+    with profile.stage('build_bundle'):
+        pass
+    profile.module_times = {'app.a': 0.1, 'app.b': 0.2}
+
+    data = profile.to_dict(tmp_path)
+    assert list(data['stages']) == ['build_bundle']
+    assert list(data['module_times']) == ['app.b', 'app.a']
+    assert data['archives']['dist.zip']['app/a.py']['size'] == 1000
+    assert data['archives']['dist.zip']['app/a.py']['compressed_size'] < 1000
+    assert data['npm_packages'] == {
+        'bundle/imports.js': {'react': 50, '@mui/material': 40, '(generated)': 10, 'clsx': 5},
+    }
+
+
+def test_patch_bundle(tmp_path: Path, monkeypatch):
+    from brickie import bundle
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(bundle, 'get_config', lambda: {'bytecode': 'off', 'bundle_compression_level': 6})
+    target_dir = tmp_path / 'build'
+    (target_dir / 'chunks').mkdir(parents=True)
+    (tmp_path / 'client').mkdir()
+    module_path = tmp_path / 'client' / 'page.py'
+    module_path.write_text('@server\nasync def f():\n    return 2\n')
+
+    write_zip(target_dir / 'dist.zip', {'client/index.py': 'index'})
+    write_zip(target_dir / 'chunks' / 'client.page.zip', {'client/page.py': 'old'})
+    (target_dir / 'bundle.json').write_text(json.dumps({
+        'modules': ['client.index', 'client.page'],
+        'stubs': [],
+        'entries': {'client/index.py': 'dist.zip', 'client/page.py': 'chunks/client.page.zip'},
+    }))
+
+    src = bundle.patch_bundle(target_dir, 'client.page', module_path)
+    assert src == build_client_source('client.page', module_path)
+    with ZipFile(target_dir / 'chunks' / 'client.page.zip') as zf:
+        assert zf.read('client/page.py').decode('utf-8') == src
+    with ZipFile(target_dir / 'dist.zip') as zf:
+        assert zf.read('client/index.py') == b'index'
+
+    assert bundle.patch_bundle(target_dir, 'client.other', tmp_path / 'client' / 'other.py') is None
+
+    monkeypatch.setattr(bundle, 'get_bundle_modules', lambda: ({'client.index': None, 'client.page': None}, []))
+    assert not bundle.is_bundle_changed(target_dir)
+    monkeypatch.setattr(bundle, 'get_bundle_modules', lambda: ({'client.index': None}, []))
+    assert bundle.is_bundle_changed(target_dir)
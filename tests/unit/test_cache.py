@@ -0,0 +1,82 @@
+import time
+
+import pytest
+
+from brickie import server
+from brickie.cache import MISSING, ResultCache, _endpoint_caches, get_stats, invalidate
+from brickie.serve import call_endpoint
+
+
+@pytest.fixture
+def endpoint_registry():
+    from brickie import _endpoint_registry, _endpoint_keys
+    _endpoint_registry.clear()
+    _endpoint_keys.clear()
+    _endpoint_caches.clear()
+    return _endpoint_registry
+
+
+def test_result_cache_key_normalized():
+    assert (
+        ResultCache.make_key({'a': [1], 'k': {'x': 1, 'y': 2}}) ==
+        ResultCache.make_key({'a': [1], 'k': {'y': 2, 'x': 1}})
+    )
+    assert ResultCache.make_key({'a': [1], 'k': {}}) != ResultCache.make_key({'a': [2], 'k': {}})
+
+    # Values of different types don't share a key
+    assert ResultCache.make_key({'a': [b'x'], 'k': {}}) != ResultCache.make_key({'a': ["b'x'"], 'k': {}})
+    assert ResultCache.make_key({'a': [1], 'k': {}}) != ResultCache.make_key({'a': [1.0], 'k': {}})
+    assert ResultCache.make_key({'a': [1], 'k': {}}) != ResultCache.make_key({'a': [True], 'k': {}})
+    assert (
+        ResultCache.make_key({'a': [{'b': 1, 'a': [2]}], 'k': {}}) ==
+        ResultCache.make_key({'a': [{'a': [2], 'b': 1}], 'k': {}})
+    )
+
+
+def test_result_cache_ttl():
+    cache = ResultCache(ttl=0.01)
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+    time.sleep(0.02)
+    assert cache.get('a') is MISSING
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_result_cache_lru():
+    cache = ResultCache(max_entries=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is MISSING
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+
+def test_server_cache(endpoint_registry):
+    import asyncio
+
+    calls = []
+
+    @server(cache={'ttl': 60})
+    async def lookup(a, b=0):
+        calls.append((a, b))
+        return a + b
+
+    key = next(iter(endpoint_registry))
+    assert asyncio.run(call_endpoint(key, lookup, {'a': [1], 'k': {'b': 2}})) == 3
+    assert asyncio.run(call_endpoint(key, lookup, {'a': [1], 'k': {'b': 2}})) == 3
+    assert asyncio.run(call_endpoint(key, lookup, {'a': [2], 'k': {}})) == 2
+    assert calls == [(1, 2), (2, 0)]
+    assert get_stats()[key] == {'hits': 1, 'misses': 2, 'entries': 2}
+
+    invalidate(lookup)
+    assert asyncio.run(call_endpoint(key, lookup, {'a': [1], 'k': {'b': 2}})) == 3
+    assert calls == [(1, 2), (2, 0), (1, 2)]
+
+
+def test_server_cache_stream_unsupported(endpoint_registry):
+    with pytest.raises(ValueError):
+        @server(cache=True)
+        async def stream():
+            yield 1
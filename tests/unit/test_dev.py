@@ -0,0 +1,168 @@
+import asyncio
+import json
+
+from pathlib import Path
+
+from starlette.applications import Starlette
+from watchfiles import Change
+
+from brickie import dev
+from brickie.client.router import _route_tree
+from brickie.serve import get_index_routes, index
+
+
+def test_get_index_routes():
+    _route_tree.insert('/dev/:item_id', 'item')
+    try:
+        paths = [r.path for r in get_index_routes()]
+    finally:
+        _route_tree.remove('/dev/:item_id')
+    assert '/' in paths
+    assert '/dev/{item_id}' in paths
+
+
+def test_reloader_watch(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(dev, 'get_config', lambda: {'npm_packages': []})
+    changes = {(Change.modified, str(tmp_path / 'module.py'))}
+
+    async def awatch(*args, stop_event, **kwargs):
+        yield changes
+        await stop_event.wait()
+
+    monkeypatch.setattr(dev, 'awatch', awatch)
+    reloader = dev.Reloader(tmp_path)
+    reload_threads = []
+
+    endpoints = dev.EndpointChanges()
+    monkeypatch.setattr(endpoints, 'install', lambda: reload_threads.append('install'))
+
+    def reload_changes(batch):
+        import threading
+        reload_threads.append(threading.current_thread().name)
+        assert batch == changes
+        return dev.ReloadResult({}, ['module'], ['module'], endpoints, 0)
+
+    def build_batch(result):
+        assert reload_threads[-1] == 'install'
+        reload_batch = dev.ReloadBatch()
+        reload_batch.reload_order.append(('module', 'dist.zip'))
+        return reload_batch
+
+    monkeypatch.setattr(reloader, 'reload_changes', reload_changes)
+    monkeypatch.setattr(reloader, 'build_batch', build_batch)
+
+    async def run():
+        app = Starlette()
+        app.add_route('/old', index)
+        app.add_route('/other', lambda request: None)
+        client = dev.ReloaderClient()
+        ws = type('WebSocket', (), {})()
+        reloader.clients[ws] = client
+
+        async with reloader.lifespan(app):
+            assert json.loads(await asyncio.wait_for(client.queue.get(), 5)) == {'n': 1, 'f': [], 'r': ['module']}
+            paths = [r.path for r in app.router.routes]
+            assert '/old' not in paths
+            assert '/' in paths and '/other' in paths
+
+            # Index routes come after server routes, so they can't shadow them
+            assert paths.index('/other') < paths.index('/')
+
+    asyncio.run(run())
+    assert reload_threads[0].startswith('brickie-reload')
+
+
+def test_reloader_resume(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(dev, 'get_config', lambda: {'npm_packages': []})
+    reloader = dev.Reloader(tmp_path)
+    for sequence in (1, 2):
+        batch = dev.ReloadBatch()
+        batch.sequence = sequence
+        src = 'import app\n' * 20
+        batch.add_file(
+            Change.modified, 'app/index.py', 'dist.zip', f'{src}a = {sequence}\n', f'{src}a = {sequence - 1}\n'
+        )
+        batch.add_file(Change.modified, 'app/page.py', 'chunks/app.page.zip', f'b = {sequence}\n', None)
+        batch.reload_order.extend([('app.index', 'dist.zip'), ('app.page', 'chunks/app.page.zip')])
+        reloader.log.append(batch)
+    reloader.sequence = 2
+
+    def get_messages(client):
+        messages = []
+        while not client.queue.empty():
+            messages.append(json.loads(client.queue.get_nowait()))
+        return messages
+
+    WebSocket = type('WebSocket', (), {})
+    ws = WebSocket()
+
+    # Resumed client gets diffs of missed batches, filtered to loaded archives
+    client = dev.ReloaderClient()
+    reloader.resume_client(ws, client, {'i': reloader.instance_id, 'n': 1})
+    hello, message = get_messages(client)
+    assert hello == {'i': reloader.instance_id}
+    assert message['n'] == 2 and message['r'] == ['app.index']
+    assert [f['p'] for f in message['f']] == ['app/index.py'] and 'd' in message['f'][0]
+    assert reloader.clients[ws] is client
+
+    # Chunk loaded after a batch gets its full source
+    reloader.add_client_chunks(client, {'c': ['app.page'], 'n': 1})
+    message, = get_messages(client)
+    assert 'n' not in message
+    assert message['f'] == [{'c': Change.modified, 'p': 'app/page.py', 's': 'b = 2\n'}]
+    assert message['r'] == ['app.page']
+
+    # Clients of another server instance, or too far behind, reload the page
+    for data in ({'i': 'other', 'n': 1}, {'i': reloader.instance_id, 'n': 5}):
+        other_ws = WebSocket()
+        client = dev.ReloaderClient()
+        reloader.resume_client(other_ws, client, data)
+        assert get_messages(client) == [{'i': reloader.instance_id, 'x': True}]
+        assert other_ws not in reloader.clients
+
+    client = dev.ReloaderClient()
+    reloader.resume_client(WebSocket(), client, {'i': None, 'n': None, 'c': ['app.page']})
+    assert get_messages(client) == [{'i': reloader.instance_id, 'n': 2}]
+    assert client.archives == {'dist.zip', 'chunks/app.page.zip'}
+
+
+def test_reload_module_staged(tmp_path: Path, monkeypatch):
+    import importlib
+    import sys
+
+    from brickie import _endpoint_keys, _endpoint_registry
+    from brickie.cache import _endpoint_caches
+
+    monkeypatch.syspath_prepend(str(tmp_path))
+    module_path = tmp_path / 'cached_module.py'
+    module_path.write_text('from brickie import server\n@server(cache=True)\nasync def f():\n    return 1\n')
+    module = importlib.import_module('cached_module')
+    try:
+        keys = set(_endpoint_keys[module_path])
+        caches = {key: _endpoint_caches[key] for key in keys}
+
+        module_path.write_text('def f(:\n')
+        endpoints = dev.EndpointChanges()
+        assert not dev.reload_module(module, module_path, Change.modified, endpoints)
+        endpoints.install()
+        assert _endpoint_keys[module_path] == keys
+        assert {key: _endpoint_caches.get(key) for key in keys} == caches
+
+        # Reloaded server functions are only registered once installed
+        module_path.write_text('from brickie import server\n@server(cache=True)\nasync def f():\n    return 2\n')
+        assert dev.reload_module(module, module_path, Change.modified, endpoints)
+        new_key, = endpoints.keys[module_path]
+        assert new_key not in keys and new_key not in _endpoint_registry
+        assert _endpoint_keys[module_path] == keys
+        assert all(key in _endpoint_registry for key in keys)
+
+        endpoints.install()
+        assert _endpoint_keys[module_path] == {new_key}
+        assert _endpoint_registry[new_key] is module.f
+        assert not keys & set(_endpoint_registry) and not keys & set(_endpoint_caches)
+        assert new_key in _endpoint_caches
+    finally:
+        for key in _endpoint_keys.pop(module_path, ()):
+            _endpoint_registry.pop(key, None)
+            _endpoint_caches.pop(key, None)
+        del sys.modules['cached_module']
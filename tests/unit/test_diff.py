@@ -0,0 +1,13 @@
+from brickie.diff import apply_source_diff, diff_source
+
+
+def test_source_diff():
+    old_src = 'import a\n\nx = 1\ny = 2\n\ndef f():\n    return x\n'
+    new_src = 'import a\nimport b\n\nx = 1\n\ndef f():\n    return x + b.y\n'
+    ops = diff_source(old_src, new_src)
+    assert apply_source_diff(old_src, ops) == new_src
+    assert all(text != 'x = 1\n' for _, _, text in ops)
+
+    assert diff_source(new_src, new_src) == []
+    assert apply_source_diff('', diff_source('', new_src)) == new_src
+    assert apply_source_diff(new_src, diff_source(new_src, '')) == ''
@@ -0,0 +1,35 @@
+from brickie.graph import ModuleGraph
+
+
+def test_module_graph_reload_order():
+    graph = ModuleGraph()
+    graph.update('app', '', is_package=True)
+    graph.update('app.utils', 'import json')
+    graph.update('app.models', 'from .utils import dumps')
+    graph.update('app.views', 'from app.models import Model\nfrom app import utils')
+    graph.update('app.index', 'from .views import View')
+    graph.update('app.other', 'import json')
+
+    assert graph.get_reload_order(['app.utils']) == ['app.utils', 'app.models', 'app.views', 'app.index']
+    assert graph.get_reload_order(['app.views']) == ['app.views', 'app.index']
+    assert graph.get_reload_order(['app.other']) == ['app.other']
+
+    # Incremental update replaces edges of changed module
+    graph.update('app.views', 'import json')
+    assert graph.get_reload_order(['app.utils']) == ['app.utils', 'app.models']
+
+    graph.remove('app.index')
+    assert 'app.index' not in graph
+    assert graph.get_reload_order(['app.views']) == ['app.views']
+
+
+def test_module_graph_cycles():
+    graph = ModuleGraph()
+    graph.update('a', 'import b')
+    graph.update('b', 'import a')
+    graph.update('c', 'import b')
+    graph.update('d', 'def f(:')
+
+    order = graph.get_reload_order(['a'])
+    assert sorted(order) == ['a', 'b', 'c'] and len(order) == 3
+    assert 'd' in graph
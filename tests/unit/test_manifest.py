@@ -0,0 +1,57 @@
+import os
+
+from pathlib import Path
+
+import pytest
+
+from brickie import manifest
+
+
+@pytest.fixture
+def manifest_path(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(manifest, '_manifest', None)
+    monkeypatch.setattr(manifest, '_entries', {})
+    return tmp_path / 'endpoints.json'
+
+
+def test_manifest_keys(tmp_path: Path, manifest_path: Path):
+    module_path = tmp_path / 'module.py'
+    module_path.write_text('async def f(): pass\n')
+    manifest.record(module_path, 'module', 'f', 'key_f')
+    manifest.record(module_path, 'module', 'A.g', 'key_g')
+    manifest.write(manifest_path)
+
+    manifest.load(manifest_path)
+    assert manifest.get_key(module_path, 'module', 'f') == 'key_f'
+    assert manifest.get_key(module_path, 'module', 'A.g') == 'key_g'
+    assert manifest.get_key(module_path, 'other', 'f') is None
+
+    # Touched but unchanged file is still valid
+    stat = module_path.stat()
+    os.utime(module_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert manifest.get_key(module_path, 'module', 'f') == 'key_f'
+
+    # Changed file falls back to hashing
+    module_path.write_text('async def f(): return 1\n')
+    assert manifest.get_key(module_path, 'module', 'f') is None
+
+
+def test_manifest_ambiguous_qualname(tmp_path: Path, manifest_path: Path):
+    module_path = tmp_path / 'module.py'
+    module_path.write_text('async def f(): pass\n')
+    manifest.record(module_path, 'module', 'f', 'key_a')
+    manifest.record(module_path, 'module', 'f', 'key_b')
+    assert manifest.get_key(module_path, 'module', 'f', recorded=True) is None
+
+    manifest.write(manifest_path)
+    manifest._manifest = None
+    manifest.load(manifest_path)
+    assert manifest.get_key(module_path, 'module', 'f') is None
+
+
+def test_manifest_recorded_keys(tmp_path: Path, manifest_path: Path):
+    module_path = tmp_path / 'module.py'
+    module_path.write_text('async def f(): pass\n')
+    manifest.record(module_path, 'module', 'f', 'key_f')
+    assert manifest.get_key(module_path, 'module', 'f') is None
+    assert manifest.get_key(module_path, 'module', 'f', recorded=True) == 'key_f'
@@ -0,0 +1,83 @@
+import importlib
+import importlib.util
+import sys
+
+from brickie.modules import ModuleIndex
+
+
+def test_module_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(sys, 'meta_path', list(sys.meta_path))
+    monkeypatch.syspath_prepend(str(tmp_path))
+    index = ModuleIndex()
+    _, offset = index.added_since(0)
+
+    # Modules imported before the index was created are indexed
+    assert index.get(sys.modules['brickie.modules'].__file__) is sys.modules['brickie.modules']
+
+    module_path = tmp_path / 'indexed_module.py'
+    module_path.write_text('value = 1')
+    assert index.get(module_path) is None
+    module = importlib.import_module('indexed_module')
+    assert index.get(module_path) is module
+
+    added, offset = index.added_since(offset)
+    assert added == [(module_path, 'indexed_module')]
+    assert index.added_since(offset) == ([], offset)
+
+    # Modules removed from `sys.modules` are not returned
+    del sys.modules['indexed_module']
+    assert index.get(module_path) is None
+
+
+def test_module_index_import_in_progress(tmp_path, monkeypatch):
+    import threading
+
+    monkeypatch.setattr(sys, 'meta_path', list(sys.meta_path))
+    monkeypatch.syspath_prepend(str(tmp_path))
+    index = ModuleIndex()
+    module_path = tmp_path / 'slow_module.py'
+    module_path.write_text('value = 1')
+
+    # Module found by another thread but not yet in `sys.modules` when the index is read
+    found = threading.Event()
+    done = threading.Event()
+
+    def find():
+        sys.meta_path[0].find_spec('slow_module', None)
+        found.set()
+        done.wait()
+
+    thread = threading.Thread(target=find)
+    thread.start()
+    found.wait()
+    assert index.get(module_path) is None
+
+    # Import completes after the lookup, without finding the module again
+    spec = importlib.util.spec_from_file_location('slow_module', module_path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['slow_module'] = module
+    spec.loader.exec_module(module)
+    try:
+        assert index.get(module_path) is module
+    finally:
+        del sys.modules['slow_module']
+        done.set()
+        thread.join()
+
+
+def test_module_index_failed_imports(tmp_path, monkeypatch):
+    import pytest
+
+    monkeypatch.setattr(sys, 'meta_path', list(sys.meta_path))
+    monkeypatch.syspath_prepend(str(tmp_path))
+    index = ModuleIndex()
+    (tmp_path / 'broken_module.py').write_text('raise RuntimeError')
+
+    with pytest.raises(ImportError):
+        importlib.import_module('missing_module')
+    with pytest.raises(RuntimeError):
+        importlib.import_module('broken_module')
+
+    # Failed imports are not kept for later lookups
+    assert index.get(tmp_path / 'broken_module.py') is None
+    assert not index._pending and not index._unresolved
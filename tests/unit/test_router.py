@@ -59,3 +59,19 @@ def test_route_tree_remove_with_params():
     assert route_tree.remove('/test/path/:param') == 'item'
     with pytest.raises(ValueError):
         route_tree.remove('/test/path/:param')
+
+
+def test_lazy_route():
+    from brickie.client.router import LazyRoute, _route_tree, route
+
+    assert route('/lazy/:param', 'app.pages.lazy:LazyPage') is None
+    try:
+        item = _route_tree.match('/lazy/20').item
+        assert isinstance(item, LazyRoute)
+        assert (item.module_name, item.component_name) == ('app.pages.lazy', 'LazyPage')
+        assert item.component is None
+    finally:
+        _route_tree.remove('/lazy/:param')
+
+    with pytest.raises(ValueError):
+        route('/lazy', 'app.pages.lazy')
@@ -0,0 +1,430 @@
+import json
+
+import pytest
+
+from starlette.applications import Starlette
+from starlette.testclient import TestClient
+
+from brickie import server
+from brickie.serve import batch_endpoint, endpoint, websocket_endpoint
+
+
+@pytest.fixture
+def endpoint_registry():
+    from brickie import _endpoint_registry, _endpoint_keys
+    _endpoint_registry.clear()
+    _endpoint_keys.clear()
+    return _endpoint_registry
+
+
+@pytest.fixture
+def client(endpoint_registry):
+    app = Starlette()
+    app.add_route('/_c', batch_endpoint, methods=['POST'])
+    app.add_route('/_c/{key}', endpoint, methods=['POST'])
+    app.add_websocket_route('/_c/ws', websocket_endpoint)
+    return TestClient(app)
+
+
+def get_key(endpoint_registry, f):
+    return next(k for k, v in endpoint_registry.items() if v is f)
+
+
+def test_endpoint(endpoint_registry, client):
+    @server
+    async def add(a, b=0):
+        return a + b
+
+    response = client.post(f'/_c/{get_key(endpoint_registry, add)}', json={'a': [1], 'k': {'b': 2}})
+    assert response.json() == {'r': 3}
+
+    response = client.post('/_c/unknown', json={'a': [], 'k': {}})
+    assert response.status_code == 404
+
+
+def test_batch_endpoint(endpoint_registry, client):
+    @server
+    async def add(a, b=0):
+        return a + b
+
+    @server
+    async def fail():
+        raise ValueError('failed')
+
+    add_key = get_key(endpoint_registry, add)
+    fail_key = get_key(endpoint_registry, fail)
+    response = client.post('/_c', json={'c': [
+        {'e': add_key, 'a': [1, 2], 'k': {}},
+        {'e': fail_key, 'a': [], 'k': {}},
+        {'e': 'unknown', 'a': [], 'k': {}},
+        {'e': add_key, 'a': [3], 'k': {'b': 4}},
+    ]})
+    assert response.status_code == 200
+    assert response.json() == {'r': [
+        {'r': 3},
+        {'e': 'Internal Server Error'},
+        {'e': 'Not Found'},
+        {'r': 7},
+    ]}
+
+
+def test_batch_endpoint_concurrent(endpoint_registry, client):
+    import asyncio
+
+    event = asyncio.Event()
+
+    @server
+    async def wait():
+        await event.wait()
+        return 'waited'
+
+    @server
+    async def notify():
+        event.set()
+        return 'notified'
+
+    # Would deadlock if batched calls were run sequentially
+    response = client.post('/_c', json={'c': [
+        {'e': get_key(endpoint_registry, wait), 'a': [], 'k': {}},
+        {'e': get_key(endpoint_registry, notify), 'a': [], 'k': {}},
+    ]})
+    assert response.json() == {'r': [{'r': 'waited'}, {'r': 'notified'}]}
+
+
+def test_websocket_endpoint(endpoint_registry, client):
+    import asyncio
+
+    event = asyncio.Event()
+
+    @server
+    async def wait():
+        await event.wait()
+        return 'waited'
+
+    @server
+    async def notify():
+        event.set()
+        return 'notified'
+
+    with client.websocket_connect('/_c/ws') as ws:
+        ws.send_json({'i': 0, 'e': get_key(endpoint_registry, wait), 'a': [], 'k': {}})
+        ws.send_json({'i': 1, 'e': get_key(endpoint_registry, notify), 'a': [], 'k': {}})
+        ws.send_json({'i': 2, 'e': 'unknown', 'a': [], 'k': {}})
+
+        # Responses are sent as calls complete, out of request order
+        results = [ws.receive_json() for _ in range(3)]
+        assert sorted(results, key=lambda r: r['i']) == [
+            {'i': 0, 'r': 'waited'},
+            {'i': 1, 'r': 'notified'},
+            {'i': 2, 'e': 'Not Found'},
+        ]
+        assert results[0]['i'] != 0
+
+
+def test_stream_endpoint(endpoint_registry, client):
+    @server
+    async def count(n):
+        for i in range(n):
+            yield {'i': i}
+        raise ValueError('failed')
+
+    response = client.post(f'/_c/{get_key(endpoint_registry, count)}', json={'a': [3], 'k': {}})
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    assert [json.loads(l) for l in response.text.splitlines()] == [
+        {'r': {'i': 0}},
+        {'r': {'i': 1}},
+        {'r': {'i': 2}},
+        {'e': 'Internal Server Error'},
+    ]
+
+
+def test_single_flight(endpoint_registry):
+    import asyncio
+
+    from brickie.serve import _inflight_calls, call_endpoint
+
+    calls = []
+
+    @server(single_flight=True)
+    async def lookup(a):
+        calls.append(a)
+        await asyncio.sleep(0.01)
+        return {'a': a}
+
+    key = get_key(endpoint_registry, lookup)
+
+    async def run():
+        return await asyncio.gather(
+            call_endpoint(key, lookup, {'a': [1], 'k': {}}),
+            call_endpoint(key, lookup, {'a': [1], 'k': {}}),
+            call_endpoint(key, lookup, {'a': [2], 'k': {}}),
+        )
+
+    results = asyncio.run(run())
+    assert results == [{'a': 1}, {'a': 1}, {'a': 2}]
+    assert results[0] is not results[1]
+    assert sorted(calls) == [1, 2]
+    assert not _inflight_calls
+
+    # Calls after completion run again
+    asyncio.run(run())
+    assert len(calls) == 4
+
+
+def test_sync_endpoint(endpoint_registry, client):
+    import threading
+
+    from brickie import executor
+
+    main_thread = threading.current_thread()
+
+    @server
+    def blocking(a):
+        assert threading.current_thread() is not main_thread
+        assert executor.get_stats()['thread_pool']['running'] == 1
+        return a * 2
+
+    executor.configure(thread_pool_size=2)
+    response = client.post(f'/_c/{get_key(endpoint_registry, blocking)}', json={'a': [2], 'k': {}})
+    assert response.json() == {'r': 4}
+    assert executor.get_stats()['thread_pool'] == {'max_workers': 2, 'queued': 0, 'running': 0}
+
+
+def test_sync_wrapper_endpoint(endpoint_registry, client):
+    import asyncio
+    import threading
+
+    from brickie import executor
+
+    async def double(a):
+        return a * 2
+
+    @server
+    def wrapper(a):
+        return double(a)
+
+    response = client.post(f'/_c/{get_key(endpoint_registry, wrapper)}', json={'a': [2], 'k': {}})
+    assert response.json() == {'r': 4}
+
+    # Queued calls cancelled before starting leave the queue
+    executor.configure(thread_pool_size=1)
+    pool = executor.get_thread_pool()
+    release = threading.Event()
+
+    async def run():
+        blocking = asyncio.ensure_future(pool.run(release.wait, (), {}))
+        queued = asyncio.ensure_future(pool.run(lambda: None, (), {}))
+        await asyncio.sleep(0.05)
+        assert pool.get_stats()['queued'] == 1
+        queued.cancel()
+        await asyncio.sleep(0.05)
+        assert pool.get_stats()['queued'] == 0
+        release.set()
+        await blocking
+
+    asyncio.run(run())
+    assert pool.get_stats() == {'max_workers': 1, 'queued': 0, 'running': 0}
+
+
+def test_thread_executor_async_endpoint(endpoint_registry, client):
+    import threading
+
+    @server(executor='thread')
+    async def thread_name():
+        import asyncio
+        await asyncio.sleep(0)
+        return threading.current_thread().name
+
+    # Coroutine runs in the worker thread, not only its creation
+    response = client.post(f'/_c/{get_key(endpoint_registry, thread_name)}', json={'a': [], 'k': {}})
+    assert response.json()['r'].startswith('brickie-server')
+
+
+def process_square(a):
+    import os
+    return a * a, os.getpid()
+
+
+def process_sleep(t):
+    import time
+    time.sleep(t)
+
+
+def test_process_endpoint(endpoint_registry):
+    import asyncio
+    import os
+
+    from brickie import executor
+    from brickie.serve import call_endpoint
+
+    square = server(executor='process')(process_square)
+    sleep = server(executor='process')(process_sleep)
+    executor.configure(process_pool_size=1, process_timeout=0.5, process_max_tasks=None)
+
+    try:
+        result, pid = asyncio.run(call_endpoint(get_key(endpoint_registry, square), square, {'a': [3], 'k': {}}))
+        assert result == 9
+        assert pid != os.getpid()
+
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(call_endpoint(get_key(endpoint_registry, sleep), sleep, {'a': [2], 'k': {}}))
+
+        # Timed out call doesn't hold the only worker
+        result, _ = asyncio.run(call_endpoint(get_key(endpoint_registry, square), square, {'a': [4], 'k': {}}))
+        assert result == 16
+    finally:
+        executor.configure(process_timeout=None)
+
+
+def test_process_endpoint_queue_wait(endpoint_registry):
+    import asyncio
+
+    from brickie import executor
+    from brickie.serve import call_endpoint
+
+    sleep = server(executor='process')(process_sleep)
+    square = server(executor='process')(process_square)
+    executor.configure(process_pool_size=2, process_timeout=0.5, process_max_tasks=1)
+
+    async def run():
+        key = get_key(endpoint_registry, sleep)
+        return await asyncio.gather(*(call_endpoint(key, sleep, {'a': [0.3], 'k': {}}) for _ in range(6)))
+
+    try:
+        # Time spent queued for a worker doesn't count towards the timeout
+        assert asyncio.run(run()) == [None] * 6
+
+        # Workers are replaced after max tasks
+        key = get_key(endpoint_registry, square)
+        pids = {asyncio.run(call_endpoint(key, square, {'a': [2], 'k': {}}))[1] for _ in range(3)}
+        assert len(pids) == 3
+    finally:
+        executor.configure(process_timeout=None, process_max_tasks=None)
+
+
+def test_process_endpoint_requires_qualname(endpoint_registry):
+    with pytest.raises(ValueError):
+        @server(executor='process')
+        def local():
+            pass
+
+
+def test_binary_encoding(endpoint_registry, client):
+    from brickie import wire
+
+    @server
+    async def concat(a, b):
+        return a + b
+
+    headers = {'Content-Type': wire.CONTENT_TYPE, 'Accept': wire.CONTENT_TYPE}
+    key = get_key(endpoint_registry, concat)
+    response = client.post(f'/_c/{key}', content=wire.dumps({'a': [b'a', b'b'], 'k': {}}), headers=headers)
+    assert response.headers['content-type'] == wire.CONTENT_TYPE
+    assert wire.loads(response.content) == {'r': b'ab'}
+
+    response = client.post('/_c', content=wire.dumps({'c': [{'e': key, 'a': [[1.0], [2.0]], 'k': {}}]}), headers=headers)
+    assert wire.loads(response.content) == {'r': [{'r': [1.0, 2.0]}]}
+
+    with client.websocket_connect('/_c/ws') as ws:
+        ws.send_bytes(wire.dumps({'i': 0, 'e': key, 'a': ['a', 'b'], 'k': {}}))
+        assert wire.loads(ws.receive_bytes()) == {'i': 0, 'r': 'ab'}
+
+
+def test_precompressed_static_files(tmp_path):
+    import gzip
+    import os
+
+    from brickie.serve import PrecompressedStaticFiles, get_accepted_encodings
+
+    assert get_accepted_encodings('gzip, br;q=0, deflate;q=0.5') == {'gzip', 'deflate'}
+
+    asset_path = tmp_path / 'imports.js'
+    asset_path.write_text('console.log("brickie");\n' * 100)
+    gz_path = tmp_path / 'imports.js.gz'
+    gz_path.write_bytes(gzip.compress(asset_path.read_bytes()))
+    stat = asset_path.stat()
+    os.utime(gz_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    app = Starlette()
+    app.mount('/_s', PrecompressedStaticFiles(directory=tmp_path))
+    client = TestClient(app)
+
+    response = client.get('/_s/imports.js', headers={'accept-encoding': 'br'})
+    assert 'content-encoding' not in response.headers
+    assert response.text == asset_path.read_text()
+    content_type = response.headers['content-type']
+
+    response = client.get('/_s/imports.js', headers={'accept-encoding': 'gzip'})
+    assert response.headers['content-encoding'] == 'gzip'
+    assert response.headers['content-type'] == content_type
+    assert response.headers['vary'] == 'Accept-Encoding'
+    assert response.text == asset_path.read_text()
+
+    # Revalidation uses the sibling validators
+    etag = client.get('/_s/imports.js', headers={'accept-encoding': 'gzip'}).headers['etag']
+    response = client.get('/_s/imports.js', headers={'accept-encoding': 'gzip', 'if-none-match': etag})
+    assert response.status_code == 304
+
+    # Stale siblings are not served
+    os.utime(gz_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    response = client.get('/_s/imports.js', headers={'accept-encoding': 'gzip'})
+    assert 'content-encoding' not in response.headers
+
+
+def test_static_cache_headers(tmp_path, monkeypatch):
+    from brickie.serve import PrecompressedStaticFiles, index
+
+    build_dir = tmp_path / '.brickie' / 'build'
+    build_dir.mkdir(parents=True)
+    (build_dir / 'index.html').write_text('<html></html>')
+    (build_dir / f'dist.{"0" * 16}.zip').write_bytes(b'dist')
+    (build_dir / 'dist.zip').write_bytes(b'dist')
+    monkeypatch.chdir(tmp_path)
+
+    app = Starlette()
+    app.add_route('/', index)
+    app.mount('/_s', PrecompressedStaticFiles(directory=build_dir))
+    client = TestClient(app)
+
+    response = client.get(f'/_s/dist.{"0" * 16}.zip')
+    assert response.headers['cache-control'] == 'public, max-age=31536000, immutable'
+    assert client.get('/_s/dist.zip').headers['cache-control'] == 'no-cache'
+    assert client.get('/_s/index.html').headers['cache-control'] == 'no-cache'
+
+    response = client.get('/')
+    assert response.headers['cache-control'] == 'no-cache'
+    response = client.get('/', headers={'if-none-match': response.headers['etag']})
+    assert response.status_code == 304
+
+
+def test_index_precompressed(tmp_path, monkeypatch):
+    import gzip
+    import os
+
+    from brickie.serve import index
+
+    build_dir = tmp_path / '.brickie' / 'build'
+    build_dir.mkdir(parents=True)
+    index_path = build_dir / 'index.html'
+    index_path.write_text('<html></html>' * 100)
+    gz_path = build_dir / 'index.html.gz'
+    gz_path.write_bytes(gzip.compress(index_path.read_bytes()))
+    stat = index_path.stat()
+    os.utime(gz_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    monkeypatch.chdir(tmp_path)
+
+    app = Starlette()
+    app.add_route('/', index)
+    client = TestClient(app)
+
+    response = client.get('/', headers={'accept-encoding': 'gzip'})
+    assert response.headers['content-encoding'] == 'gzip'
+    assert response.headers['content-type'].startswith('text/html')
+    assert response.headers['vary'] == 'Accept-Encoding'
+    assert response.text == index_path.read_text()
+    response = client.get('/', headers={'accept-encoding': 'gzip', 'if-none-match': response.headers['etag']})
+    assert response.status_code == 304
+
+    response = client.get('/', headers={'accept-encoding': 'identity'})
+    assert 'content-encoding' not in response.headers
+    assert response.headers['vary'] == 'Accept-Encoding'
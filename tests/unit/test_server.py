@@ -108,3 +108,56 @@ def test_server_methods():
     with temp_module(TestClass) as path:
         src = build_client_source(__name__, path)
         assert 'is_method=True' in src
+
+
+def test_server_stream():
+    @server
+    async def test_server_function():
+        pass
+
+    @server
+    async def test_server_generator():
+        def nested():
+            yield 1
+        for i in range(3):
+            yield i
+
+    with temp_module(test_server_function) as path:
+        src = build_client_source(__name__, path)
+        assert 'stream=True' not in src
+
+    with temp_module(test_server_generator) as path:
+        src = build_client_source(__name__, path)
+        assert 'stream=True' in src
+        assert 'yield' not in src
+
+
+def test_server_options_not_on_client():
+    @server(cache={'ttl': 5})
+    async def test_server_function():
+        pass
+
+    with temp_module(test_server_function) as path:
+        src = build_client_source(__name__, path)
+        assert 'ttl' not in src
+        assert 'is_method=False' in src
+
+
+def test_server_sync_endpoint_key(endpoint_registry):
+    @server(cache=True)
+    def test_server_function():
+        return 'sync'
+
+    src = build_client_source(__name__, Path(__file__))
+
+    assert len(endpoint_registry) == 1
+    key = list(endpoint_registry.keys())[0]
+    assert key in src
+
+
+def test_server_sync_generator_unsupported():
+    with NamedTemporaryFile('wt') as f:
+        f.write('@server\ndef test_server_generator():\n    yield 1\n')
+        f.flush()
+        with pytest.raises(RuntimeError):
+            build_client_source(__name__, Path(f.name))
@@ -0,0 +1,37 @@
+import pytest
+
+from brickie import wire
+
+
+@pytest.mark.parametrize('value', [
+    None, True, False,
+    0, 1, -1, 2 ** 63, -2 ** 70,
+    0.0, 1.5, -1e300,
+    '', 'text', 'ünïcode',
+    b'', b'\x00\xff' * 100,
+    [], [1], [1, 2, 3], [-200, 200], [-2 ** 20, 1], [1.0, 2.5], [1, 2.0], [True, False], [2 ** 64, 1], [1, 'a', None],
+    {}, {'a': [1, {'b': None}], 'c': b'bytes'},
+])
+def test_wire_roundtrip(value):
+    assert wire.loads(wire.dumps(value)) == value
+
+
+def test_wire_numeric_arrays():
+    assert wire.dumps([1.0, 2.0])[0] == wire.T_FLOAT_ARRAY
+    assert wire.dumps([1, 2])[0] == wire.T_INT_ARRAY
+    assert wire.dumps([True, False])[0] == wire.T_LIST
+    assert wire.dumps((1, 2)) == wire.dumps([1, 2])
+
+    values = [float(i) for i in range(1000)]
+    assert len(wire.dumps(values)) < 1000 * 8 + 8
+
+    # Integer arrays use smallest element size
+    assert len(wire.dumps(list(range(100)))) < 100 + 8
+    assert wire.loads(wire.dumps([-2 ** 40, 2 ** 40])) == [-2 ** 40, 2 ** 40]
+
+
+def test_wire_errors():
+    with pytest.raises(TypeError):
+        wire.dumps(object())
+    with pytest.raises(ValueError):
+        wire.loads(wire.dumps(1) + b'\x00')